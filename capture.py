@@ -0,0 +1,534 @@
+import contextlib
+import heapq
+import itertools
+import os
+import threading
+import time
+import weakref
+import zipfile
+import cv2 as cv
+import numpy as np
+from profiling import profiler
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".webm")
+# After a failed grab the next one is taken this many seconds later, doubling with every failure in a row.
+CAPTURE_RETRY = 0.05
+MAX_CAPTURE_RETRY = 2.0
+
+
+class FrameSource:
+    """
+    Where pictures of the application window come from.
+    grab() returns a context manager yielding a BGRA np.ndarray, or None when no picture is available.
+    The yielded array is only valid until the context manager exits.
+    """
+
+    def grab(self):
+        raise NotImplementedError
+
+    def grab_into(self, out, roi=None):
+        """
+        Copies the roi of a picture, or the whole picture, into the preallocated BGRA array out.
+        Returns out, or None when no picture is available.
+        """
+        with self.grab() as img:
+            if img is None:
+                return None
+            np.copyto(out, crop(img, roi))
+        return out
+
+    def focus(self):
+        """
+        Brings the window the pictures are taken of to the front, so it receives the keys that are sent.
+        """
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WindowSource(FrameSource):
+    """
+    Captures a live application window through gdi_capture, only available on Windows.
+    Without a window handle, the first window of the executable is captured.
+    """
+
+    def __init__(self, executable_name="MapleStory.exe", hwnd=None):
+        # gdi_capture loads a WinDLL on import, keep it out of the way of the other sources.
+        import gdi_capture
+        self._gdi_capture = gdi_capture
+        self.name = executable_name
+        self.hwnd = hwnd if hwnd is not None else gdi_capture.find_window_from_executable_name(executable_name)
+
+    @staticmethod
+    def all(executable_name="MapleStory.exe"):
+        """
+        Returns a WindowSource for every open window of the executable, e.g. to run several clients.
+        """
+        import gdi_capture
+        return [WindowSource(executable_name, hwnd) for hwnd in gdi_capture.find_windows_from_executable_name(executable_name)]
+
+    def grab(self):
+        return self._gdi_capture.CaptureWindow(self.hwnd)
+
+    def focus(self):
+        self._gdi_capture.focus_window(self.hwnd)
+
+
+def crop(img, roi):
+    """
+    Returns a view of the ((row1, row2), (column1, column2)) region of interest of a picture, or the picture if roi is None.
+    """
+    if roi is None:
+        return img
+    (r1, r2), (c1, c2) = roi
+    return img[r1:r2, c1:c2]
+
+
+class BufferPool:
+    """
+    Reusable arrays of one shape, so pictures of a region of interest can be taken every tick without allocating.
+    A buffer goes back to the pool once it is released, possibly from another thread.
+    """
+
+    def __init__(self, shape, dtype=np.uint8, count=0):
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self._free = [np.empty(self.shape, dtype) for _ in range(count)]
+        self._lock = threading.Lock()
+        self.allocated = count
+
+    def acquire(self):
+        """
+        Returns a free buffer, a new one is only allocated when every buffer is in use.
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return np.empty(self.shape, self.dtype)
+
+    def release(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+
+
+def to_bgra(img):
+    """
+    Converts a grayscale, BGR or BGRA picture to BGRA.
+    """
+    if img.ndim == 2:
+        return cv.cvtColor(img, cv.COLOR_GRAY2BGRA)
+    if img.shape[2] == 3:
+        return cv.cvtColor(img, cv.COLOR_BGR2BGRA)
+    return img
+
+
+def decode_image(data):
+    """
+    Decodes an encoded picture, e.g. the bytes of a .png file, to BGRA. Returns None if it cannot be decoded.
+    """
+    img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), cv.IMREAD_UNCHANGED)
+    return to_bgra(img) if img is not None else None
+
+
+def read_image(path):
+    """
+    Reads a picture file as BGRA. Returns None if it cannot be read.
+    """
+    img = cv.imread(path, cv.IMREAD_UNCHANGED)
+    return to_bgra(img) if img is not None else None
+
+
+def _readable(names, frames, path):
+    """
+    Leaves out the pictures that could not be read, with a warning naming each of them.
+    """
+    for name, img in zip(names, frames):
+        if img is None:
+            print(f"Skipping {name} of {path}, it could not be read.")
+    kept = [(name, img) for name, img in zip(names, frames) if img is not None]
+    return [name for name, _ in kept], [img for _, img in kept]
+
+
+def load_frames(path, fps=30):
+    """
+    Reads recorded pictures from a directory or single image, a .zip of images, a .npz archive or a video file.
+    Returns the BGRA pictures, their timestamps in seconds and a name for each of them.
+    An .npz archive holds a "frames" array of shape (N, height, width, 4) and optionally "timestamps" and "names".
+    """
+    if os.path.isdir(path):
+        names = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+        frames = [read_image(os.path.join(path, f)) for f in names]
+        names, frames = _readable(names, frames, path)
+        timestamps = [i / fps for i in range(len(frames))]
+    elif path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            names = sorted(f for f in archive.namelist() if f.lower().endswith(IMAGE_EXTENSIONS))
+            frames = [decode_image(archive.read(f)) for f in names]
+        names, frames = _readable(names, frames, path)
+        timestamps = [i / fps for i in range(len(frames))]
+    elif path.lower().endswith(".npz"):
+        with np.load(path) as archive:
+            frames = list(archive["frames"])
+            if "timestamps" in archive:
+                timestamps = list(archive["timestamps"] - archive["timestamps"][0])
+            else:
+                timestamps = [i / fps for i in range(len(frames))]
+            names = list(archive["names"]) if "names" in archive else [str(i) for i in range(len(frames))]
+    elif path.lower().endswith(VIDEO_EXTENSIONS):
+        video = cv.VideoCapture(path)
+        fps = video.get(cv.CAP_PROP_FPS) or fps
+        frames = []
+        while True:
+            ok, img = video.read()
+            if not ok:
+                break
+            frames.append(to_bgra(img))
+        video.release()
+        timestamps = [i / fps for i in range(len(frames))]
+        names = [str(i) for i in range(len(frames))]
+    else:
+        img = read_image(path)
+        if img is None:
+            raise ValueError(f"Could not read a picture from {path}.")
+        frames = [img]
+        timestamps = [0.0]
+        names = [os.path.basename(path)]
+    return frames, timestamps, names
+
+
+class ReplaySource(FrameSource):
+    """
+    Replays recorded pictures in place of the application window, see load_frames() for the formats read.
+    With a speed, pictures are handed out as they would have appeared in real time scaled by that factor.
+    With speed=None, every grab() advances to the next picture so recordings can be processed as fast as possible.
+    """
+
+    def __init__(self, path, speed=1.0, loop=True, fps=30):
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        frames, timestamps, self.names = load_frames(path, fps)
+        if not frames:
+            raise ValueError(f"No frames found in {path}.")
+        self.frames = []
+        for img in frames:
+            img = np.ascontiguousarray(img)
+            img.setflags(write=False)
+            self.frames.append(img)
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)
+        # Recordings loop after their last picture has been shown for one picture's worth of time.
+        self.duration = self.timestamps[-1] + (1 / fps)
+        self.index = -1
+        self._next = 0
+        self._start = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    @property
+    def name(self):
+        """
+        The name of the picture returned by the last grab().
+        """
+        return self.names[self.index] if 0 <= self.index < len(self.names) else None
+
+    def _due(self):
+        """
+        Returns the index of the picture to hand out next, or None once a non-looping recording has ended.
+        """
+        if self.speed is None:
+            i = self._next
+            self._next += 1
+            if i >= len(self.frames):
+                return i % len(self.frames) if self.loop else None
+            return i
+
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        elapsed = (now - self._start) * self.speed
+        if elapsed >= self.duration:
+            if not self.loop:
+                return None
+            elapsed %= self.duration
+        return int(np.searchsorted(self.timestamps, elapsed, side="right")) - 1
+
+    @contextlib.contextmanager
+    def grab(self):
+        i = self._due()
+        self.index = i if i is not None else len(self.frames)
+        yield self.frames[i] if i is not None else None
+
+
+class CaptureWorker:
+    """
+    Keeps taking pictures of the application window on a background thread at a target rate.
+    Pictures are copied into a small ring of preallocated buffers and published as frames, so readers
+    always get the newest completed frame without waiting on the capture DLL.
+    """
+
+    def __init__(self, capture, make_frame, fps=30, buffers=3):
+        """
+        capture() must return a context manager yielding the BGRA picture or None, like FrameSource.grab().
+        make_frame(image, timestamp, sequence) wraps a filled buffer into the frame that is published.
+        """
+        self.capture = capture
+        self.make_frame = make_frame
+        self.interval = 1 / fps
+        self.captured = 0
+        self.dropped = 0
+        # The number of grabs in a row that failed, and the error that stopped capturing altogether.
+        self.failures = 0
+        self.error = None
+        self._buffers = [None] * buffers
+        # A buffer is only refilled once nobody holds the frame that was published from it.
+        self._published = [None] * buffers
+        self._slot = 0
+        self._latest = None
+        self._condition = threading.Condition()
+        self._running = threading.Event()
+        self._thread = None
+        # A CaptureScheduler taking the pictures instead of a thread of the worker's own.
+        self.scheduler = None
+
+    def start(self):
+        if self._thread is not None or self.scheduler is not None:
+            return
+        self.error = None
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="capture-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running.clear()
+        self._thread.join()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None or self.scheduler is not None
+
+    def latest(self):
+        """
+        Returns the newest completed frame, or None if nothing has been captured yet.
+        Raises a RuntimeError once capturing stopped because of an error, rather than returning a stale frame.
+        """
+        self._check()
+        return self._latest
+
+    def wait_newer(self, sequence, timeout=None):
+        """
+        Returns the newest frame captured after the given sequence number, waiting up to timeout seconds for it.
+        Returns None if no such frame was captured in time, raises a RuntimeError like latest().
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.error is not None or self._latest is not None and self._latest.sequence > sequence,
+                timeout)
+            self._check()
+            frame = self._latest
+        return frame if frame is not None and frame.sequence > sequence else None
+
+    def fail(self, error):
+        """
+        Marks capturing as stopped because of error, waking up readers so they get the error.
+        """
+        with self._condition:
+            self.error = error
+            self._condition.notify_all()
+
+    def retry_delay(self):
+        """
+        Returns how long to wait before the next grab, which grows with every failed grab in a row.
+        """
+        return min(CAPTURE_RETRY * 2 ** (self.failures - 1), MAX_CAPTURE_RETRY) if self.failures else 0.0
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("Capturing the window stopped.") from self.error
+
+    def _free_slot(self):
+        """
+        Returns the index of a buffer that no published frame still refers to, or None if all are in use.
+        """
+        for i in range(len(self._buffers)):
+            slot = (self._slot + i) % len(self._buffers)
+            published = self._published[slot]
+            if published is None or published() is None:
+                self._slot = (slot + 1) % len(self._buffers)
+                return slot
+        return None
+
+    def grab_once(self):
+        """
+        Takes one picture and publishes it as the newest frame, unless every buffer is still in use.
+        Returns False if taking the picture failed, the next one should then wait for retry_delay().
+        """
+        try:
+            self._grab()
+        except Exception as e:
+            # A window that is minimized, resized or closed for a moment should not end capturing.
+            if not self.failures:
+                print(f"Could not take a picture of the window: {e!r}")
+            self.failures += 1
+            profiler.count("capture.errors")
+            return False
+        self.failures = 0
+        return True
+
+    def _grab(self):
+        slot = self._free_slot()
+        if slot is None:
+            self.dropped += 1
+            profiler.count("frames.dropped")
+            return
+        with profiler.time("capture"), self.capture() as img:
+            timestamp = time.perf_counter()
+            if img is not None:
+                buffer = self._buffers[slot]
+                if buffer is None or buffer.shape != img.shape:
+                    # Buffers are allocated once the window size is known and reused afterwards.
+                    buffer = self._buffers[slot] = np.empty_like(img)
+                np.copyto(buffer, img)
+        if img is not None:
+            self.captured += 1
+            profiler.count("frames.captured")
+            frame = self.make_frame(buffer, timestamp, self.captured)
+            self._published[slot] = weakref.ref(frame)
+            with self._condition:
+                self._latest = frame
+                self._condition.notify_all()
+
+    def _run(self):
+        try:
+            self._capture()
+        except Exception as e:
+            print(f"Capturing the window stopped: {e!r}")
+            self.fail(e)
+
+    def _capture(self):
+        deadline = time.perf_counter()
+        while self._running.is_set():
+            if not self.grab_once():
+                time.sleep(self.retry_delay())
+                deadline = time.perf_counter()
+                continue
+            deadline += self.interval
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Capturing fell behind the target rate, do not try to catch up with a burst of pictures.
+                deadline = time.perf_counter()
+
+
+class CaptureScheduler:
+    """
+    Takes the pictures of several CaptureWorkers, e.g. one per application window, on a single thread.
+    The worker whose next picture is most overdue is captured first, so grabs are spread evenly across windows and a
+    window that falls behind only delays itself. With max_rate, no more than that many pictures are taken per second
+    in total and every window gets an equal share of them.
+    """
+
+    def __init__(self, max_rate=None):
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.grabs = 0
+        self._queue = []
+        self._order = itertools.count()
+        # Every worker's queue entries carry the number it was added with, entries of removed workers are skipped.
+        self._workers = {}
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def add(self, worker):
+        """
+        Takes pictures for a worker from now on, instead of the worker's own thread.
+        """
+        with self._condition:
+            if worker in self._workers:
+                return
+            worker.scheduler = self
+            worker.error = None
+            added = self._workers[worker] = next(self._order)
+            heapq.heappush(self._queue, (time.perf_counter(), next(self._order), worker, added))
+            self._condition.notify_all()
+
+    def remove(self, worker):
+        with self._condition:
+            self._workers.pop(worker, None)
+            worker.scheduler = None
+            self._condition.notify_all()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="capture-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        try:
+            self._schedule()
+        except Exception as e:
+            # Readers of every worker get the error rather than the last frame taken before it.
+            print(f"Capturing the windows stopped: {e!r}")
+            with self._condition:
+                workers = list(self._workers)
+            for worker in workers:
+                worker.fail(e)
+
+    def _schedule(self):
+        last = None
+        while True:
+            with self._condition:
+                while True:
+                    if not self._running:
+                        return
+                    # Removed workers are dropped once they come up.
+                    while self._queue and self._workers.get(self._queue[0][2]) != self._queue[0][3]:
+                        heapq.heappop(self._queue)
+                    if not self._queue:
+                        self._condition.wait()
+                        continue
+                    due = self._queue[0][0]
+                    if last is not None:
+                        due = max(due, last + self.interval)
+                    delay = due - time.perf_counter()
+                    if delay <= 0:
+                        break
+                    # A worker added or removed meanwhile wakes the thread up.
+                    self._condition.wait(delay)
+                deadline, _, worker, added = heapq.heappop(self._queue)
+            grabbed = worker.grab_once()
+            last = time.perf_counter()
+            self.grabs += 1
+            with self._condition:
+                if self._workers.get(worker) == added:
+                    if grabbed:
+                        # Behind schedule, the worker is due again right away but does not get to catch up.
+                        due = max(deadline + worker.interval, last - worker.interval)
+                    else:
+                        # A failing window is retried later, without taking turns away from the others.
+                        due = last + worker.retry_delay()
+                    heapq.heappush(self._queue, (due, next(self._order), worker, added))
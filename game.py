@@ -1,5 +1,11 @@
-import gdi_capture
+import threading
+import time
 import numpy as np
+from collections import deque, namedtuple
+from capture import CaptureWorker, WindowSource, crop
+from minimap import RegionCache, check_minimap, find_minimap
+from profiling import profiler
+from rune_solver import RUNE_ROI, RUNE_SHAPE
 
 # These are colors taken from the mini-map in BGRA format.
 PLAYER_BGRA = (68, 221, 255, 255)
@@ -8,73 +14,551 @@ ENEMY_BGRA = (0, 0, 255, 255)
 GUILD_BGRA = (255, 102, 102, 255)
 BUDDY_BGRA = (225, 221, 17, 255)
 
+# Every color that is parsed from the mini-map, these are classified together in a single pass.
+MINIMAP_BGRA = (PLAYER_BGRA, RUNE_BGRA, ENEMY_BGRA, GUILD_BGRA, BUDDY_BGRA)
+OTHER_BGRA = (ENEMY_BGRA, GUILD_BGRA, BUDDY_BGRA)
+
+# Pictures between checks that an automatically found mini-map is still in place, and between searches while it is not.
+REGION_CHECK_INTERVAL = 30
+REGION_SEARCH_INTERVAL = 5
+# Frames have an empty mini-map while it has not been found.
+NO_REGION = (0, 0, 0, 0)
+
+# Queries that only depend on the pixels of the mini-map, frames with the same mini-map share their results.
+MINIMAP_QUERIES = ("matches", "player")
+
+# The number of matching pixels, the mean (x, y) position and the (x1, y1, x2, y2) bounding box of a color.
+ColorMatch = namedtuple("ColorMatch", ["count", "centroid", "bbox"])
+
+
+def pack_bgra(color):
+    """
+    Packs a BGRA tuple into the uint32 value a pixel has when the image is viewed as little-endian uint32.
+    """
+    b, g, r, a = color
+    return b | (g << 8) | (r << 16) | (a << 24)
+
+
+def match_colors(img, colors):
+    """
+    Classifies every pixel of a BGRA image against all BGRA tuple(s) in one vectorized pass.
+    Returns a dict mapping each color to a ColorMatch, or None if the color was not found.
+    """
+    colors = tuple(colors)
+    height, width = img.shape[0], img.shape[1]
+    # Each 4-byte BGRA pixel is viewed as a single uint32 so one comparison tests all four channels.
+    packed = np.ascontiguousarray(img, dtype=np.uint8).view(np.uint32).ravel()
+    keys = np.array([pack_bgra(c) for c in colors], dtype=np.uint32)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    # Look up every pixel in the sorted color table, misses land on a neighbouring key and are discarded.
+    slots = np.minimum(np.searchsorted(sorted_keys, packed), len(sorted_keys) - 1)
+    hits = np.flatnonzero(sorted_keys[slots] == packed)
+    labels = order[slots[hits]]
+    xs, ys = hits % width, hits // width
+
+    n = len(colors)
+    counts = np.bincount(labels, minlength=n)
+    sum_x = np.bincount(labels, weights=xs, minlength=n)
+    sum_y = np.bincount(labels, weights=ys, minlength=n)
+    min_x, min_y = np.full(n, width), np.full(n, height)
+    max_x, max_y = np.full(n, -1), np.full(n, -1)
+    np.minimum.at(min_x, labels, xs)
+    np.minimum.at(min_y, labels, ys)
+    np.maximum.at(max_x, labels, xs)
+    np.maximum.at(max_y, labels, ys)
+
+    matches = {}
+    for i, c in enumerate(colors):
+        count = int(counts[i])
+        if count > 0:
+            centroid = (float(sum_x[i] / count), float(sum_y[i] / count))
+            bbox = (int(min_x[i]), int(min_y[i]), int(max_x[i]), int(max_y[i]))
+            matches[c] = ColorMatch(count, centroid, bbox)
+        else:
+            matches.setdefault(c, None)
+    return matches
+
+
+def _match_minimap(frame):
+    with profiler.time("parse.minimap"):
+        return match_colors(frame.minimap, MINIMAP_BGRA)
+
+
+class ParseCache:
+    """
+    Remembers the mini-map queries parsed from the last distinct picture of the mini-map.
+    The character mostly stands still, so consecutive mini-maps are often identical and their parse results can be
+    reused. Each frame's mini-map is compared against a copy of the last one parsed, which is exact and costs a
+    fraction of a parse, unlike a sampled checksum that could miss the dot moving by a single pixel.
+    """
+
+    def __init__(self):
+        self.minimap = None
+        self.region = None
+        self.queries = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        """
+        Returns how often a frame's mini-map was unchanged and its parse results reused.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else None}
+
+    def lookup(self, frame):
+        """
+        Returns the generation of the cache the frame belongs to and the results parsed for it so far.
+        A frame with a different mini-map starts a new generation.
+        """
+        minimap = frame.minimap
+        with self._lock:
+            if frame.region == self.region and np.array_equal(minimap, self.minimap):
+                self.hits += 1
+                profiler.count("parse.cache_hits")
+                return self.generation, dict(self.queries)
+            self.misses += 1
+            self.minimap = minimap.copy()
+            self.region = frame.region
+            self.queries = {}
+            self.generation += 1
+            return self.generation, {}
+
+    def store(self, generation, name, result):
+        with self._lock:
+            if generation == self.generation:
+                self.queries[name] = result
+
+
+class Frame:
+    """
+    An immutable picture of the application window taken by Game.snapshot().
+    Queries about the mini-map are parsed lazily on first access and memoized, so callers sharing a
+    frame within the same tick only pay for one capture and one parse.
+    Each frame carries the monotonic time it was captured at and an increasing sequence number.
+    """
+
+    def __init__(self, image, region, timestamp=None, sequence=0, cache=None):
+        # The frame only hands out a read-only view, the buffer underneath may belong to a CaptureWorker.
+        image = image.view()
+        image.setflags(write=False)
+        self._image = image
+        self._region = region
+        self._queries = {}
+        # Results of MINIMAP_QUERIES are shared through a ParseCache with frames of an identical mini-map.
+        self._cache = cache
+        self._generation = None
+        self.timestamp = time.perf_counter() if timestamp is None else timestamp
+        self.sequence = sequence
+
+    @property
+    def age(self):
+        """
+        Seconds elapsed since the picture was captured.
+        """
+        return time.perf_counter() - self.timestamp
+
+    def copy(self):
+        """
+        Returns a frame that owns its own copy of the picture.
+        """
+        return Frame(self._image.copy(), self._region, self.timestamp, self.sequence, self._cache)
+
+    @property
+    def image(self):
+        """
+        The read-only BGRA picture of the whole application window.
+        """
+        return self._image
+
+    @property
+    def region(self):
+        """
+        The (top, left, bottom, right) region of the mini-map the frame was taken with.
+        """
+        return self._region
+
+    @property
+    def minimap(self):
+        """
+        A read-only view of the mini-map region of the picture.
+        """
+        top, left, bottom, right = self._region
+        return self._image[left:right, top:bottom]
+
+    def query(self, name, parse):
+        """
+        Returns parse(frame), memoized under name for the lifetime of the frame.
+        """
+        if name not in self._queries:
+            if self._cache is not None and name in MINIMAP_QUERIES:
+                if self._generation is None:
+                    self._generation, queries = self._cache.lookup(self)
+                    self._queries.update(queries)
+                    if name in self._queries:
+                        return self._queries[name]
+                self._queries[name] = parse(self)
+                self._cache.store(self._generation, name, self._queries[name])
+            else:
+                self._queries[name] = parse(self)
+        return self._queries[name]
+
+    def parsed(self, name):
+        """
+        Returns a boolean value based on whether a query has already been memoized.
+        """
+        return name in self._queries
+
+    @property
+    def matches(self):
+        """
+        Returns the ColorMatch of every mini-map color, classified in a single pass.
+        """
+        return self.query("matches", _match_minimap)
+
+    def locate(self, *color):
+        """
+        Returns the median location of BGRA tuple(s).
+        """
+        matches = self.matches
+        if any(c not in matches for c in color):
+            matches = match_colors(self.minimap, color)
+        return [matches[c].centroid for c in color if matches[c] is not None]
+
+    @property
+    def player_location(self):
+        """
+        The (x, y) position of the player on the mini-map.
+        """
+        match = self.player_match
+        return match.centroid if match is not None else None
+
+    @property
+    def player_match(self):
+        """
+        The ColorMatch of the player dot, which a PlayerTracker may have found without scanning the whole mini-map.
+        """
+        return self.query("player", lambda f: f.matches[PLAYER_BGRA])
+
+    @property
+    def rune_location(self):
+        """
+        The (x, y) position of the rune on the mini-map.
+        """
+        match = self.matches[RUNE_BGRA]
+        return match.centroid if match is not None else None
+
+    @property
+    def other_location(self):
+        """
+        A boolean value representing the presence of any other players on the mini-map.
+        """
+        return any(self.matches[c] is not None for c in OTHER_BGRA)
+
+
+class PlayerTracker:
+    """
+    Follows the player dot across consecutive frames.
+    The dot only moves a few pixels between frames, so it is first searched for in a small window around where
+    its last position and velocity predict it to be, falling back to a scan of the whole mini-map when it is not there.
+    """
+
+    def __init__(self, margin=6, max_gap=0.5, history=32):
+        # How many pixels the search window extends past the predicted bounding box of the dot.
+        self.margin = margin
+        # Frames further apart than this many seconds are not used to estimate velocity.
+        self.max_gap = max_gap
+        self.match = None
+        self.timestamp = None
+        self.velocity = (0.0, 0.0)
+        # Positions are relative to the mini-map region, they cannot be compared across regions.
+        self.region = None
+        # The (timestamp, x, y) positions of the dot in the most recent frames, oldest first.
+        self.history = deque(maxlen=history)
+        self.hits = 0
+        self.misses = 0
+        self.pixels_scanned = 0
+
+    def reset(self):
+        self.match = None
+        self.timestamp = None
+        self.velocity = (0.0, 0.0)
+        self.history.clear()
+
+    def stats(self):
+        """
+        Returns how often the dot was found in its predicted window and how many pixels were scanned on average.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else None,
+            "pixels_per_frame": self.pixels_scanned / total if total else None,
+        }
+
+    def locate(self, frame):
+        """
+        Returns the (x, y) position of the player in a frame, memoizing its ColorMatch in the frame.
+        """
+        if frame.region != self.region:
+            self.reset()
+            self.region = frame.region
+        with profiler.time("parse.player"):
+            match = frame.query("player", self._track)
+        self._update(match, frame.timestamp)
+        return match.centroid if match is not None else None
+
+    def motion(self, window=0.15):
+        """
+        Returns the (vx, vy) velocity of the dot in pixels per second, averaged over the last window seconds.
+        Positions are rounded to whole pixels, so the velocity between two consecutive frames alone is too noisy.
+        """
+        if len(self.history) < 2:
+            return 0.0, 0.0
+        t2, x2, y2 = self.history[-1]
+        t1, x1, y1 = self.history[-2]
+        for t, x, y in reversed(self.history):
+            if t2 - t > window:
+                break
+            t1, x1, y1 = t, x, y
+        if t2 <= t1:
+            return 0.0, 0.0
+        return (x2 - x1) / (t2 - t1), (y2 - y1) / (t2 - t1)
+
+    def settled(self, duration=0.15, tolerance=1.0):
+        """
+        Returns a boolean value based on whether the dot stayed within tolerance pixels for the last duration seconds.
+        """
+        if not self.history:
+            return False
+        t2, x2, y2 = self.history[-1]
+        for t, x, y in reversed(self.history):
+            if abs(x - x2) > tolerance or abs(y - y2) > tolerance:
+                return False
+            if t2 - t >= duration:
+                return True
+        return False
+
+    def _predicted_window(self, frame):
+        """
+        Returns the (x1, y1, x2, y2) mini-map window the dot is expected to be in.
+        """
+        dt = frame.timestamp - self.timestamp
+        shift_x, shift_y = self.velocity[0] * dt, self.velocity[1] * dt
+        x1, y1, x2, y2 = self.match.bbox
+        height, width = frame.minimap.shape[0], frame.minimap.shape[1]
+        return (
+            max(0, int(x1 + shift_x) - self.margin), max(0, int(y1 + shift_y) - self.margin),
+            min(width, int(x2 + shift_x) + self.margin + 1), min(height, int(y2 + shift_y) + self.margin + 1),
+        )
+
+    def _track(self, frame):
+        minimap = frame.minimap
+        if self.match is not None and not frame.parsed("matches"):
+            x1, y1, x2, y2 = self._predicted_window(frame)
+            if x1 < x2 and y1 < y2:
+                self.pixels_scanned += (x2 - x1) * (y2 - y1)
+                match = match_colors(minimap[y1:y2, x1:x2], (PLAYER_BGRA,))[PLAYER_BGRA]
+                # A dot touching the edge of the window may be cut off, only trust dots fully inside of it.
+                if match is not None:
+                    bx1, by1, bx2, by2 = match.bbox
+                    inside_x = (bx1 > 0 or x1 == 0) and (bx2 < x2 - x1 - 1 or x2 == minimap.shape[1])
+                    inside_y = (by1 > 0 or y1 == 0) and (by2 < y2 - y1 - 1 or y2 == minimap.shape[0])
+                    if inside_x and inside_y:
+                        self.hits += 1
+                        return ColorMatch(
+                            match.count,
+                            (match.centroid[0] + x1, match.centroid[1] + y1),
+                            (bx1 + x1, by1 + y1, bx2 + x1, by2 + y1),
+                        )
+        self.misses += 1
+        self.pixels_scanned += minimap.shape[0] * minimap.shape[1]
+        return frame.matches[PLAYER_BGRA]
+
+    def _update(self, match, timestamp):
+        if match is None:
+            # The dot was lost, the next frame is scanned in full.
+            self.reset()
+            return
+        if self.history and timestamp - self.history[-1][0] > self.max_gap:
+            self.history.clear()
+        if not self.history or timestamp > self.history[-1][0]:
+            self.history.append((timestamp, match.centroid[0], match.centroid[1]))
+        if self.match is not None and 0 < timestamp - self.timestamp <= self.max_gap:
+            dt = timestamp - self.timestamp
+            self.velocity = (
+                (match.centroid[0] - self.match.centroid[0]) / dt,
+                (match.centroid[1] - self.match.centroid[1]) / dt,
+            )
+        elif self.match is None or timestamp != self.timestamp:
+            self.velocity = (0.0, 0.0)
+        self.match = match
+        self.timestamp = timestamp
+
 
 class Game:
-    def __init__(self, region):
-        self.hwnd = gdi_capture.find_window_from_executable_name("MapleStory.exe")
+    def __init__(self, region=None, source=None, map_name="default", cache=None, recorder=None):
+        # Pictures come from the live MapleStory.exe window unless another FrameSource, e.g. a replay, is given.
+        self.source = source if source is not None else WindowSource("MapleStory.exe")
         # These values should represent pixel locations on the screen of the mini-map.
-        self.top, self.left, self.bottom, self.right = region[0], region[1], region[2], region[3]
+        # Without a region, the mini-map is found on the pictures and remembered per map_name in a RegionCache.
+        self.auto_region = region is None
+        self.top, self.left, self.bottom, self.right = region if region is not None else NO_REGION
+        self.map_name = map_name
+        self.cache = cache if cache is not None or not self.auto_region else RegionCache()
+        self._region_checked = None
+        self.sequence = 0
+        self.worker = None
+        self.tracker = PlayerTracker()
+        self.parse_cache = ParseCache()
+        # A FlightRecorder keeps every mini-map, rune picture, detection and stroke of the session.
+        self.recorder = recorder
 
-    def get_rune_image(self):
+    @property
+    def region(self):
+        return self.top, self.left, self.bottom, self.right
+
+    def _update_region(self, image, sequence):
         """
-        Takes a picture of the application window.
+        Checks every few pictures that the mini-map is still where it was found, and searches for it otherwise.
+        The region cached for the map is tried before searching the whole picture.
+        """
+        found = self.region != NO_REGION
+        interval = REGION_CHECK_INTERVAL if found else REGION_SEARCH_INTERVAL
+        if self._region_checked is not None and 0 <= sequence - self._region_checked < interval:
+            return
+        self._region_checked = sequence
+        if found and check_minimap(image, self.region):
+            return
+        region = self.cache.get(self.map_name, image.shape)
+        if region is None or not check_minimap(image, region):
+            with profiler.time("parse.region"):
+                region = find_minimap(image, PLAYER_BGRA)
+            if region is not None:
+                self.cache.put(self.map_name, image.shape, region)
+        if region is None:
+            if found:
+                print("The mini-map was lost.")
+            region = NO_REGION
+        self.top, self.left, self.bottom, self.right = region
+
+    def start_capture(self, fps=30, buffers=3, scheduler=None):
+        """
+        Starts a background CaptureWorker, snapshot() will then return its newest frame instead of capturing.
+        With a CaptureScheduler, e.g. shared by the games of several windows, it takes the pictures instead of a thread
+        of the worker's own.
         """
-        with gdi_capture.CaptureWindow(self.hwnd) as img:
+        if self.worker is None:
+            self.worker = CaptureWorker(self.source.grab, self._make_frame, fps, buffers)
+            if scheduler is not None:
+                scheduler.add(self.worker)
+            else:
+                self.worker.start()
+
+    def stop_capture(self):
+        if self.worker is not None:
+            if self.worker.scheduler is not None:
+                self.worker.scheduler.remove(self.worker)
+            self.worker.stop()
+            self.worker = None
+
+    def _make_frame(self, image, timestamp, sequence):
+        if self.auto_region:
+            self._update_region(image, sequence)
+        frame = Frame(image, self.region, timestamp, sequence, self.parse_cache)
+        if self.recorder is not None:
+            self.recorder.minimap(frame)
+        return frame
+
+    def snapshot(self, newer_than=None, timeout=1):
+        """
+        Returns a picture of the application window as a Frame, or None if the window was not found.
+        With a background worker running, the newest completed frame is returned without waiting, unless
+        newer_than is given, in which case it waits up to timeout seconds for a frame after that sequence number.
+        """
+        if self.worker is not None:
+            if newer_than is None:
+                frame = self.worker.latest()
+                if frame is not None:
+                    return frame
+                newer_than = 0
+            return self.worker.wait_newer(newer_than, timeout)
+
+        with profiler.time("capture"), self.source.grab() as img:
             if img is None:
                 print("MapleStory.exe was not found.")
                 return None
-            return img.copy()
+            self.sequence += 1
+            # The bitmap is freed once the capture exits, the frame keeps its own copy.
+            return self._make_frame(img.copy(), time.perf_counter(), self.sequence)
+
+    def capture_roi(self, roi, out, newer_than=None, timeout=1):
+        """
+        Copies the ((row1, row2), (column1, column2)) region of interest of a picture into the preallocated array out,
+        without copying the rest of the window. newer_than and timeout work as in snapshot().
+        Returns the sequence number of the picture, or None if the window was not found.
+        """
+        if self.worker is not None:
+            frame = self.snapshot(newer_than, timeout)
+            if frame is None:
+                return None
+            np.copyto(out, crop(frame.image, roi))
+            if self.recorder is not None:
+                self.recorder.rune(out, frame.sequence, roi, frame.timestamp)
+            return frame.sequence
+
+        with profiler.time("capture"):
+            if self.source.grab_into(out, roi) is None:
+                print("MapleStory.exe was not found.")
+                return None
+        self.sequence += 1
+        if self.recorder is not None:
+            self.recorder.rune(out, self.sequence, roi)
+        return self.sequence
+
+    def get_rune_image(self):
+        """
+        Takes a picture of the application window.
+        """
+        frame = self.snapshot()
+        return frame.image if frame is not None else None
+
+    def get_rune_roi(self, out=None):
+        """
+        Takes a picture of only the part of the application window runes appear in, see rune_solver.RUNE_ROI,
+        into out if given. Pass origin=rune_solver.RUNE_ORIGIN to find_arrow_directions() along with it.
+        """
+        out = out if out is not None else np.empty(RUNE_SHAPE, dtype=np.uint8)
+        return out if self.capture_roi(RUNE_ROI, out) is not None else None
 
     def locate(self, *color):
         """
         Returns the median location of BGRA tuple(s).
         """
-        with gdi_capture.CaptureWindow(self.hwnd) as img:
-            locations = []
-            if img is None:
-                print("MapleStory.exe was not found.")
-            else:
-                """
-                The screenshot of the application window is returned as a 3-d np.ndarray, 
-                containing 4-length np.ndarray(s) representing BGRA values of each pixel.
-                """
-                # Crop the image to show only the mini-map.
-                img_cropped = img[self.left:self.right, self.top:self.bottom]
-                height, width = img_cropped.shape[0], img_cropped.shape[1]
-                # Reshape the image from 3-d to 2-d by row-major order.
-                img_reshaped = np.reshape(img_cropped, ((width * height), 4), order="C")
-                for c in color:
-                    sum_x, sum_y, count = 0, 0, 0
-                    # Find all index(s) of np.ndarray matching a specified BGRA tuple.
-                    matches = np.where(np.all((img_reshaped == c), axis=1))[0]
-                    for idx in matches:
-                        # Calculate the original (x, y) position of each matching index.
-                        sum_x += idx % width
-                        sum_y += idx // width
-                        count += 1
-                    if count > 0:
-                        x_pos = sum_x / count
-                        y_pos = sum_y / count
-                        locations.append((x_pos, y_pos))
-            return locations
+        frame = self.snapshot()
+        return frame.locate(*color) if frame is not None else []
 
     def get_player_location(self):
         """
         Returns the (x, y) position of the player on the mini-map.
         """
-        location = self.locate(PLAYER_BGRA)
-        return location[0] if len(location) > 0 else None
+        frame = self.snapshot()
+        return self.tracker.locate(frame) if frame is not None else None
 
     def get_rune_location(self):
         """
         Returns the (x, y) position of the rune on the mini-map.
         """
-        location = self.locate(RUNE_BGRA)
-        return location[0] if len(location) > 0 else None
+        frame = self.snapshot()
+        return frame.rune_location if frame is not None else None
 
     def get_other_location(self):
         """
         Returns a boolean value representing the presence of any other players on the mini-map.
         """
-        location = self.locate(ENEMY_BGRA, GUILD_BGRA, BUDDY_BGRA)
-        return len(location) > 0
+        frame = self.snapshot()
+        return frame.other_location if frame is not None else False
@@ -1 +1 @@
-from gdi_capture.gdi_capture import find_window_from_executable_name, CaptureWindow
+from gdi_capture.gdi_capture import find_window_from_executable_name, find_windows_from_executable_name, focus_window, CaptureWindow
@@ -37,3 +37,49 @@ class CaptureWindow:
 			return
 
 		gdi_capture_dll.FreeBitmapHandle(ctypes.wintypes.HBITMAP(self.bitmap_handle))
+
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+GW_OWNER = 4
+SW_RESTORE = 9
+EnumWindowsProc = ctypes.WINFUNCTYPE(ctypes.wintypes.BOOL, ctypes.wintypes.HWND, ctypes.wintypes.LPARAM)
+
+def find_windows_from_executable_name(name):
+	"""
+	Returns the handle of the main window of every running process of the executable, e.g. to run several clients.
+	"""
+	user32 = ctypes.windll.user32
+	kernel32 = ctypes.windll.kernel32
+	handles = []
+	processes = set()
+
+	def check(hwnd, _):
+		if not user32.IsWindowVisible(hwnd) or user32.GetWindow(hwnd, GW_OWNER):
+			return True
+		pid = ctypes.wintypes.DWORD()
+		user32.GetWindowThreadProcessId(hwnd, ctypes.byref(pid))
+		if pid.value in processes:
+			return True
+		process = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid.value)
+		if not process:
+			return True
+		try:
+			path = ctypes.create_unicode_buffer(260)
+			size = ctypes.wintypes.DWORD(len(path))
+			if kernel32.QueryFullProcessImageNameW(process, 0, path, ctypes.byref(size)) and os.path.basename(path.value).lower() == name.lower():
+				processes.add(pid.value)
+				handles.append(hwnd)
+		finally:
+			kernel32.CloseHandle(process)
+		return True
+
+	user32.EnumWindows(EnumWindowsProc(check), 0)
+	return handles
+
+def focus_window(hwnd):
+	"""
+	Brings a window to the front, keys sent through Interception go to the window in front.
+	"""
+	user32 = ctypes.windll.user32
+	if user32.IsIconic(hwnd):
+		user32.ShowWindow(hwnd, SW_RESTORE)
+	user32.SetForegroundWindow(hwnd)
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import threading
+import time
+from profiling import profiler
+
+# Sleeping is only accurate to a few milliseconds, the last stretch before a deadline is spun instead.
+SPIN_THRESHOLD = 0.002
+
+
+class InputScheduler:
+    """
+    Sends strokes on a dedicated thread at precise deadlines.
+    Strokes are kept in a time-ordered queue, strokes due at the same time are sent in the order they were queued.
+    Queueing returns immediately, so the control loop never sleeps between a down-stroke and its up-stroke.
+    Several players can share one scheduler, each queueing its strokes with its own send and as their owner,
+    so each of them can wait for its own strokes without waiting for the others'.
+    """
+
+    def __init__(self, send=None):
+        """
+        send(stroke) delivers a single stroke, e.g. lambda stroke: context.send(device, stroke).
+        It is used for strokes queued without a send of their own.
+        """
+        self.send = send
+        self._queue = []
+        self._order = itertools.count()
+        self._sending = False
+        # The number of strokes of every owner that have not been sent yet.
+        self._owned = {}
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="input-scheduler", daemon=True)
+        self._thread.start()
+
+    def schedule(self, stroke, deadline=None, send=None, owner=None):
+        """
+        Queues a stroke to be sent at the given time.perf_counter() deadline, or as soon as possible.
+        owner, e.g. the Player queueing the stroke, lets pending() and flush() tell its strokes from others'.
+        """
+        deadline = time.perf_counter() if deadline is None else deadline
+        with self._condition:
+            heapq.heappush(self._queue, (deadline, next(self._order), stroke, send or self.send, owner))
+            self._owned[owner] = self._owned.get(owner, 0) + 1
+            self._condition.notify_all()
+
+    def pending(self, owner=None):
+        """
+        Returns the number of strokes that have not been sent yet, only those of owner if given.
+        """
+        with self._condition:
+            if owner is not None:
+                return self._owned.get(owner, 0)
+            return len(self._queue) + self._sending
+
+    def flush(self, timeout=None, owner=None):
+        """
+        Waits until every queued stroke has been sent, or only every stroke of owner if given.
+        Returns False if the timeout elapsed first.
+        """
+        with self._condition:
+            if owner is not None:
+                return self._condition.wait_for(lambda: owner not in self._owned, timeout)
+            return self._condition.wait_for(lambda: not self._queue and not self._sending, timeout)
+
+    def close(self):
+        """
+        Sends whatever is still queued and stops the thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._queue:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    remaining = self._queue[0][0] - time.perf_counter()
+                    if remaining <= SPIN_THRESHOLD or self._closed:
+                        break
+                    # Wake up a little early, a newly queued earlier stroke also wakes the thread.
+                    self._condition.wait(remaining - SPIN_THRESHOLD)
+                deadline, _, stroke, send, owner = heapq.heappop(self._queue)
+                self._sending = True
+
+            while time.perf_counter() < deadline:
+                pass
+            # How late strokes go out compared to when they were due.
+            profiler.record("input.lateness", time.perf_counter() - deadline)
+            try:
+                send(stroke)
+            except Exception as e:
+                # A stroke that could not be sent is dropped, the strokes after it still go out.
+                print(f"Could not send a stroke: {e!r}")
+                profiler.count("input.send_errors")
+            finally:
+                with self._condition:
+                    self._sending = False
+                    self._owned[owner] -= 1
+                    if not self._owned[owner]:
+                        del self._owned[owner]
+                    self._condition.notify_all()
@@ -1,3 +1,4 @@
 from interception.interception import *
 from interception.consts import *
 from interception.stroke import *
+from interception.mock import *
@@ -5,27 +5,42 @@ from interception.stroke import *
 MAX_DEVICES = 20
 MAX_KEYBOARD = 10
 MAX_MOUSE = 10
-k32 = windll.LoadLibrary('kernel32')
+# kernel32 is only loaded once the driver backend is used, so the package can be imported on any platform.
+k32 = None
 
 
-class interception():
-    _context = []
-    k32 = None
-    _c_events = (c_void_p * MAX_DEVICES)()
+def load_kernel32():
+    global k32
+    if k32 is None:
+        k32 = windll.LoadLibrary('kernel32')
+    return k32
+
+
+class driver_backend():
+    """
+    Talks to the Interception driver through its device handles, only available on Windows.
+    """
 
     def __init__(self):
+        self._c_events = (c_void_p * MAX_DEVICES)()
+
+    def open_devices(self):
+        load_kernel32()
+        devices = []
         try:
             for i in range(MAX_DEVICES):
                 _device = device(k32.CreateFileA(b'\\\\.\\interception%02d' % i,
                                                  0x80000000, 0, 0, 3, 0, 0),
                                  k32.CreateEventA(0, 1, 0, 0),
                                  interception.is_keyboard(i))
-                self._context.append(_device)
+                devices.append(_device)
                 self._c_events[i] = _device.event
 
         except Exception as e:
-            self._destroy_context()
+            for _device in devices:
+                _device.destroy()
             raise e
+        return devices
 
     def wait(self, milliseconds=-1):
 
@@ -35,6 +50,19 @@ class interception():
         else:
             return result
 
+
+class interception():
+
+    def __init__(self, backend=None):
+        """
+        Opens every device of a backend, the Interception driver unless another backend, e.g. a mock_backend, is given.
+        """
+        self.backend = backend if backend is not None else driver_backend()
+        self._context = self.backend.open_devices()
+
+    def wait(self, milliseconds=-1):
+        return self.backend.wait(milliseconds)
+
     def set_filter(self, predicate, filter):
         for i in range(MAX_DEVICES):
             if predicate(i):
@@ -56,6 +84,10 @@ class interception():
         if not interception.is_invalid(device):
             self._context[device].send(stroke)
 
+    def send_many(self, device: int, strokes):
+        if not interception.is_invalid(device):
+            self._context[device].send_many(strokes)
+
     @staticmethod
     def is_keyboard(device):
         return device + 1 > 0 and device + 1 <= MAX_KEYBOARD
@@ -74,15 +106,20 @@ class interception():
 
 
 class device_io_result:
-    result = 0
-    data = None
-    data_bytes = None
+    __slots__ = ('result', '_buffer')
 
-    def __init__(self, result, data):
+    def __init__(self, result, buffer):
         self.result = result
-        if data != None:
-            self.data = list(data)
-            self.data_bytes = bytes(data)
+        # The output buffer is shared by the device, it is only copied if the data is asked for.
+        self._buffer = buffer
+
+    @property
+    def data(self):
+        return list(self._buffer) if self._buffer is not None else None
+
+    @property
+    def data_bytes(self):
+        return bytes(self._buffer) if self._buffer is not None else None
 
 
 def device_io_call(decorated):
@@ -163,13 +200,18 @@ class device():
         return self._parser.parse_raw(data)
 
     def send(self, stroke: stroke):
-        if type(stroke) == self._parser:
-            self._send(stroke)
+        if stroke.__class__ is self._parser:
+            self._send_raw(stroke.data_raw)
 
-    @device_io_call
-    def _send(self, stroke: stroke):
-        memmove(self._c_recv_buffer, stroke.data_raw, len(self._c_recv_buffer))
-        return 0x222080, self._c_recv_buffer, 0
+    def send_many(self, strokes):
+        # The driver accepts an array of strokes, so they are packed back to back and sent in a single call.
+        data = b''.join([s.data_raw for s in strokes if s.__class__ is self._parser])
+        if data:
+            self._send_raw(data)
+
+    def _send_raw(self, data: bytes):
+        # The packed stroke is handed to the driver as is, without copying it into a shared buffer first.
+        return k32.DeviceIoControl(self.handle, 0x222080, data, len(data), 0, 0, self._bytes_returned, 0)
 
     @device_io_call
     def _device_set_event(self):
@@ -178,9 +220,9 @@ class device():
 
     def _device_io_control(self, command, inbuffer, outbuffer) -> device_io_result:
         res = k32.DeviceIoControl(self.handle, command, inbuffer,
-                                  len(bytes(inbuffer)) if inbuffer != 0 else 0,
+                                  sizeof(inbuffer) if inbuffer != 0 else 0,
                                   outbuffer,
-                                  len(bytes(outbuffer)) if outbuffer != 0 else 0,
+                                  sizeof(outbuffer) if outbuffer != 0 else 0,
                                   self._bytes_returned, 0)
 
         return device_io_result(res, outbuffer if outbuffer != 0 else None)
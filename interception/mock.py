@@ -0,0 +1,164 @@
+import threading
+import time
+from array import array
+from interception.stroke import *
+
+MOCK_DEVICES = 20
+MOCK_KEYBOARD = 10
+
+
+class stroke_timeline():
+    """
+    Every stroke sent to a mock_backend, stored column by column in compact arrays.
+    Keyboard strokes record their code, mouse strokes their flags, in the code column.
+    """
+
+    def __init__(self):
+        self.time = array('d')
+        self.device = array('B')
+        self.code = array('H')
+        self.state = array('H')
+        self.x = array('i')
+        self.y = array('i')
+        self.information = array('I')
+
+    def __len__(self):
+        return len(self.time)
+
+    def append(self, timestamp, device, stroke):
+        self.time.append(timestamp)
+        self.device.append(device)
+        if isinstance(stroke, key_stroke):
+            self.code.append(stroke.code)
+            self.x.append(0)
+            self.y.append(0)
+        else:
+            self.code.append(stroke.flags)
+            self.x.append(stroke.x)
+            self.y.append(stroke.y)
+        self.state.append(stroke.state)
+        self.information.append(stroke.information)
+
+    def clear(self):
+        for column in (self.time, self.device, self.code, self.state, self.x, self.y, self.information):
+            del column[:]
+
+    def keys(self):
+        """
+        Returns the (time, device, code, state) of every keyboard stroke.
+        """
+        return [(self.time[i], self.device[i], self.code[i], self.state[i])
+                for i in range(len(self.time)) if self.device[i] < MOCK_KEYBOARD]
+
+    def stats(self):
+        """
+        Returns the number of strokes, their throughput and the mean, max and jitter of the gaps between sends.
+        Strokes sent together in one call share a timestamp and count as a single send.
+        """
+        sends = sorted(set(self.time))
+        gaps = [b - a for a, b in zip(sends, sends[1:])]
+        duration = sends[-1] - sends[0] if sends else 0.0
+        mean = sum(gaps) / len(gaps) if gaps else 0.0
+        return {
+            "strokes": len(self.time),
+            "sends": len(sends),
+            "duration": duration,
+            "strokes_per_second": len(self.time) / duration if duration > 0 else None,
+            "mean_gap": mean,
+            "max_gap": max(gaps) if gaps else 0.0,
+            "jitter": (sum((g - mean) ** 2 for g in gaps) / len(gaps)) ** 0.5 if gaps else 0.0,
+        }
+
+
+class mock_device():
+    """
+    Stands in for a device opened by the driver, recording whatever is sent to it.
+    """
+
+    def __init__(self, backend, index, is_keyboard: bool):
+        self.backend = backend
+        self.index = index
+        self.is_keyboard = is_keyboard
+        self.event = index + 1
+        self.filter = 0
+        self.precedence = 0
+        self._parser = key_stroke if is_keyboard else mouse_stroke
+
+    def destroy(self):
+        pass
+
+    def get_filter(self):
+        return self.filter
+
+    def set_filter(self, filter):
+        self.filter = filter
+
+    def get_precedence(self):
+        return self.precedence
+
+    def set_precedence(self, precedence: int):
+        self.precedence = precedence
+
+    def get_HWID(self):
+        return ("MOCK\\%02d" % self.index).encode("utf-16")
+
+    def receive(self):
+        return self.backend.take_input(self.index)
+
+    def send(self, stroke: stroke):
+        if stroke.__class__ is self._parser:
+            self.backend.record(self.index, (stroke,))
+
+    def send_many(self, strokes):
+        self.backend.record(self.index, [s for s in strokes if s.__class__ is self._parser])
+
+
+class mock_backend():
+    """
+    An in-memory replacement for the Interception driver.
+    Sent strokes are timestamped into a stroke_timeline, and input for receive() can be injected.
+    Listeners are called with (device, strokes) for every send, e.g. to drive a simulated game.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.timeline = stroke_timeline()
+        self.listeners = []
+        self._inputs = []
+        self._condition = threading.Condition()
+
+    def open_devices(self):
+        return [mock_device(self, i, i < MOCK_KEYBOARD) for i in range(MOCK_DEVICES)]
+
+    def record(self, device, strokes):
+        if not strokes:
+            return
+        with self._condition:
+            timestamp = self.clock()
+            for s in strokes:
+                self.timeline.append(timestamp, device, s)
+        for listener in self.listeners:
+            listener(device, strokes)
+
+    def inject(self, device, stroke):
+        """
+        Queues a stroke as if it was typed on a device, to be picked up by wait() and receive().
+        """
+        with self._condition:
+            self._inputs.append((device, stroke))
+            self._condition.notify_all()
+
+    def take_input(self, device):
+        with self._condition:
+            for i, (d, s) in enumerate(self._inputs):
+                if d == device:
+                    del self._inputs[i]
+                    return s
+        return None
+
+    def wait(self, milliseconds=-1):
+        with self._condition:
+            timeout = None if milliseconds < 0 else milliseconds / 1000
+            if not self._condition.wait_for(lambda: self._inputs, timeout):
+                return 0
+            return self._inputs[0][0]
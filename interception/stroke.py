@@ -2,6 +2,8 @@ import struct
 
 
 class stroke():
+    __slots__ = ()
+
     @property
     def data(self):
         raise NotImplementedError
@@ -12,14 +14,9 @@ class stroke():
 
 
 class mouse_stroke(stroke):
+    __slots__ = ('state', 'flags', 'rolling', 'x', 'y', 'information')
     fmt = 'HHhiiI'
     fmt_raw = 'HHHHIiiI'
-    state = 0
-    flags = 0
-    rolling = 0
-    x = 0
-    y = 0
-    information = 0
 
     def __init__(self, state, flags, rolling, x, y, information):
         super().__init__()
@@ -71,12 +68,14 @@ class mouse_stroke(stroke):
         return data
 
 
+# Packed raw key strokes by (code, state), a game only ever sends a handful of distinct ones.
+_key_raw_cache = {}
+
+
 class key_stroke(stroke):
+    __slots__ = ('code', 'state', 'information')
     fmt = 'HHI'
     fmt_raw = 'HHHHI'
-    code = 0
-    state = 0
-    information = 0
 
     def __init__(self, code, state, information):
         super().__init__()
@@ -100,5 +99,10 @@ class key_stroke(stroke):
 
     @property
     def data_raw(self):
-        data = struct.pack(self.fmt_raw, 0, self.code, self.state, 0, self.information)
+        if self.information != 0:
+            return struct.pack(self.fmt_raw, 0, self.code, self.state, 0, self.information)
+        key = (self.code, self.state)
+        data = _key_raw_cache.get(key)
+        if data is None:
+            data = _key_raw_cache[key] = struct.pack(self.fmt_raw, 0, self.code, self.state, 0, 0)
         return data
@@ -0,0 +1,13 @@
+import json
+import os
+
+
+def write_json_atomic(path, data, **options):
+    """
+    Writes data to a JSON file, replacing it in a single step, so a crash never leaves a truncated file behind.
+    options are passed on to json.dump(), e.g. indent=2.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(data, f, **options)
+    os.replace(temporary, path)
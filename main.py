@@ -1,9 +1,26 @@
+import asyncio
 import time
 import random
-from rune_solver import find_arrow_directions
+from concurrent.futures import ProcessPoolExecutor
+from rune_solver import RunePipeline
 from interception import *
+from capture import WindowSource
 from game import Game
 from player import Player
+from supervisor import Supervisor
+from recorder import FlightRecorder
+from navigation import NavigationGraph
+from rotation import RotationScheduler, load_rotation, ROTATION_PATH
+from profiling import profiler
+
+# Set to a path, e.g. "profile.json", to write the latency of every stage of the bot to it every 10 seconds.
+PROFILE_PATH = None
+# Set to a path, e.g. "session.rec", to record the session for `python recorder.py session.rec` to replay.
+RECORD_PATH = None
+# Set to True to play every open MapleStory.exe window at once instead of only the first one, see supervisor.py.
+ALL_WINDOWS = False
+# The mini-map of the example script, Game(map_name=...) finds the mini-map by itself instead.
+REGION = (5, 60, 180, 130)
 
 
 def bind(context):
@@ -18,26 +35,30 @@ def bind(context):
             break
     return device
 
-def solve_rune(g, p, target):
+def solve_rune(g, p, target, pipeline):
     """
     Given the (x, y) location of a rune, the bot will attempt to move the player to the rune and solve it.
+    The rune is solved from a burst of pictures by a RunePipeline.
     """
     while True:
         print("Pathing towards rune...")
-        p.go_to(target)
+        if not p.travel(target, timeout=30):
+            print("Could not reach the rune.")
+            break
         # Activate the rune.
         time.sleep(1)
         p.press("SPACE")
-        # Take a picture of the rune.
-        time.sleep(1)
-        img = g.get_rune_image()
+        # Take pictures of the rune until they agree on its arrows.
+        time.sleep(0.5)
         print("Attempting to solve rune...")
-        directions = find_arrow_directions(img)
+        directions = pipeline.solve()
 
         if len(directions) == 4:
             print(f"Directions: {directions}.")
+            # The arrows have to be entered strictly in order.
             for d, _ in directions:
                 p.press(d)
+                p.wait()
 
             # The player dot will be blocking the rune dot, attempt to move left/right to unblock it.
             p.hold("LEFT")
@@ -48,8 +69,8 @@ def solve_rune(g, p, target):
             time.sleep(random.uniform(0.5, 1.25))
             p.release("RIGHT")
 
-            rune_location = g.get_rune_location()
-            if rune_location is None:
+            frame = g.snapshot()
+            if frame is not None and frame.rune_location is None:
                 print("Rune has been solved.")
                 break
             else:
@@ -57,41 +78,49 @@ def solve_rune(g, p, target):
 
 
 if __name__ == "__main__":
+    if PROFILE_PATH is not None:
+        profiler.enable(PROFILE_PATH, interval=10)
+
     # This setup is required for Interception to mimic your keyboard.
     c = interception()
     d = bind(c)
 
     # Example Script for Hayato @ SS4.
-    g = Game((5, 60, 180, 130))
-    p = Player(c, d, g)
-    target = (97, 32.5)
+    # The skills, their keys, cooldowns and where to cast them are defined in rotation.json.
+    skills = load_rotation(ROTATION_PATH)
 
-    while True:
-        other_location = g.get_other_location()
-        if other_location > 0:
-            print("A player has entered your map.")
+    if ALL_WINDOWS:
+        supervisor = Supervisor(c, d)
+        # Every client's runes are searched on one pool of processes rather than a pool each.
+        pool = ProcessPoolExecutor()
+        for i, source in enumerate(WindowSource.all("MapleStory.exe")):
+            recorder = FlightRecorder(f"{RECORD_PATH}.{i}") if RECORD_PATH is not None else None
+            g = Game(REGION, source=source, recorder=recorder)
+            # Each client learns the map into a file of its own, so their saves never replace each other's.
+            supervisor.add(
+                g, skills, navigation=NavigationGraph("hayato_ss4", path=f"navigation_graphs.{i}.json"),
+                on_rune=lambda client, location, pipeline=RunePipeline(g, pool=pool): solve_rune(
+                    client.game, client.player, location, pipeline),
+                on_other=lambda client, locations: print(f"A player has entered the map of {client.name}."),
+            )
+        print(f"Running {len(supervisor.clients)} clients...")
+        asyncio.run(supervisor.run())
+    else:
+        # The positions in rotation.json are relative to this region.
+        g = Game(REGION, recorder=FlightRecorder(RECORD_PATH) if RECORD_PATH is not None else None)
+        # Keep capturing in the background so the rotation never waits on a fresh picture.
+        g.start_capture(fps=30)
+        # The map is learned while the bot moves around, runes are then reached along the quickest known path.
+        p = Player(c, d, g, navigation=NavigationGraph("hayato_ss4"))
+        pipeline = RunePipeline(g)
 
-        rune_location = g.get_rune_location()
-        if rune_location is not None:
+        def on_rune(location):
             print("A rune has appeared.")
-            solve_rune(g, p, rune_location)
+            solve_rune(g, p, location, pipeline)
+
+        def on_other(locations):
+            print("A player has entered your map.")
 
         print("Running...")
-        p.go_to(target)
-        p.press("Q")
-        time.sleep(0.5)
-        p.press("W")
-        time.sleep(3)
-        p.go_to(target)
-        p.press("LEFT")
-        time.sleep(0.5)
-        p.hold("E")
-        time.sleep(0.5)
-        p.release("E")
-        p.go_to(target)
-        p.press("RIGHT")
-        time.sleep(0.5)
-        p.hold("E")
-        time.sleep(0.5)
-        p.release("E")
-        time.sleep(3)
+        scheduler = RotationScheduler(p, g, skills, on_rune, on_other)
+        asyncio.run(scheduler.run())
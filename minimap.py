@@ -0,0 +1,188 @@
+import json
+import os
+import numpy as np
+from jsonfile import write_json_atomic
+
+# Regions use the (top, left, bottom, right) order Game takes, where the mini-map is image[left:right, top:bottom],
+# i.e. top and bottom are columns and left and right are rows of the picture.
+
+# The content of the mini-map is framed by a light gray line about 2 pixels wide.
+BORDER_MIN = 140
+BORDER_SPREAD = 16
+# Shorter lines, e.g. in text or on buttons, are not considered part of the frame.
+MIN_SIDE = 24
+# Sides of the coarse search may be this many (downsampled) pixels apart and still belong to the same rectangle.
+TOLERANCE = 3
+# The share of a side that has to look like the frame, the corners are rounded.
+COVERAGE = 0.7
+# Where the regions found are remembered across runs.
+CACHE_PATH = "minimap_regions.json"
+
+
+def border_mask(img):
+    """
+    Returns a boolean mask of the pixels that could belong to the frame of the mini-map.
+    """
+    bgr = img[..., :3]
+    lo = bgr.min(axis=2)
+    return (lo >= BORDER_MIN) & (bgr.max(axis=2) - lo <= BORDER_SPREAD)
+
+
+def segments(mask, min_length):
+    """
+    Returns the (row, start, end) of every horizontal run of at least min_length True values, end being exclusive.
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    keep = ends - starts >= min_length
+    return list(zip(rows[keep].tolist(), starts[keep].tolist(), ends[keep].tolist()))
+
+
+def rectangles(mask, min_side):
+    """
+    Returns the (x1, y1, x2, y2) positions of the lines of every rectangle drawn in mask.
+    """
+    vertical = {}
+    for x, y1, y2 in segments(mask.T, min_side):
+        vertical.setdefault(x, []).append((y1, y2))
+    horizontal = {}
+    for y, x1, x2 in segments(mask, min_side):
+        horizontal.setdefault(y, []).append((x1, x2))
+
+    def sides(x, y1):
+        """
+        Returns where every vertical line near x that starts near y1 ends.
+        """
+        return [
+            c2 - 1 for column in range(x - TOLERANCE, x + TOLERANCE + 1)
+            for c1, c2 in vertical.get(column, ()) if abs(c1 - y1) <= TOLERANCE
+        ]
+
+    found = []
+    for y1, lines in horizontal.items():
+        for a1, a2 in lines:
+            x1, x2 = a1, a2 - 1
+            # The rounded corners make the sides start and end a little inside the top and bottom lines.
+            rights = sides(x2, y1)
+            for y2 in sides(x1, y1):
+                if not any(abs(r - y2) <= TOLERANCE for r in rights):
+                    continue
+                bottom = [
+                    (b1, b2) for row in range(y2 - TOLERANCE, y2 + TOLERANCE + 1)
+                    for b1, b2 in horizontal.get(row, ()) if abs(b1 - a1) <= TOLERANCE and abs(b2 - a2) <= TOLERANCE
+                ]
+                if bottom:
+                    found.append((x1, y1, x2, y2))
+    return found
+
+
+def _lines(img, center, start, end, axis, reach):
+    """
+    Returns the indices of the rows (axis 0) or columns (axis 1) within reach of center whose middle, between start
+    and end, looks like the frame.
+    """
+    margin = (end - start) // 8
+    size = img.shape[axis]
+    first, last = max(0, center - reach), min(size, center + reach + 1)
+    if axis == 0:
+        band = border_mask(img[first:last, start + margin:end - margin])
+        share = band.mean(axis=1) if band.shape[1] else np.zeros(last - first)
+    else:
+        band = border_mask(img[start + margin:end - margin, first:last])
+        share = band.mean(axis=0) if band.shape[0] else np.zeros(last - first)
+    return [first + i for i in np.flatnonzero(share >= COVERAGE).tolist()]
+
+
+def _refine(img, rect, scale):
+    """
+    Returns the region just inside the frame of a rectangle found at a lower scale, at full resolution.
+    """
+    x1, y1, x2, y2 = (v * scale for v in rect)
+    reach = scale + 2
+    top = _lines(img, y1, x1, x2, 0, reach)
+    bottom = _lines(img, y2, x1, x2, 0, reach)
+    left = _lines(img, x1, y1, y2, 1, reach)
+    right = _lines(img, x2, y1, y2, 1, reach)
+    if not (top and bottom and left and right):
+        return None
+    return max(left) + 1, max(top) + 1, min(right), min(bottom)
+
+
+def find_minimap(img, marker=None, scale=2):
+    """
+    Returns the region inside the frame of the mini-map in a BGRA picture, or None if it was not found.
+    Rectangles are first searched for in a picture downsampled by scale, then refined at full resolution.
+    With a marker BGRA color, e.g. of the player dot, only rectangles around a pixel of that color are considered,
+    otherwise the largest rectangle is taken. The smallest rectangle around the marker is the mini-map itself,
+    rather than the window around it.
+    """
+    candidates = []
+    for rect in rectangles(border_mask(img[::scale, ::scale]), MIN_SIDE // scale):
+        region = _refine(img, rect, scale)
+        if region is None:
+            continue
+        top, left, bottom, right = region
+        if top >= bottom or left >= right:
+            continue
+        if marker is not None and not np.all(img[left:right, top:bottom] == marker, axis=2).any():
+            continue
+        candidates.append(((bottom - top) * (right - left), region))
+    if not candidates:
+        return None
+    candidates.sort()
+    return candidates[0][1] if marker is not None else candidates[-1][1]
+
+
+def check_minimap(img, region, threshold=COVERAGE):
+    """
+    Returns a boolean value based on whether the frame of the mini-map is still right around a region.
+    Only the four lines next to the region are looked at, so this is cheap enough to run on any picture.
+    """
+    top, left, bottom, right = region
+    height, width = img.shape[0], img.shape[1]
+    if top < 1 or left < 1 or bottom >= width or right >= height or top >= bottom or left >= right:
+        return False
+    sides = (
+        border_mask(img[left - 1:left, top:bottom])[0],
+        border_mask(img[right:right + 1, top:bottom])[0],
+        border_mask(img[left:right, top - 1:top])[:, 0],
+        border_mask(img[left:right, bottom:bottom + 1])[:, 0],
+    )
+    for side in sides:
+        margin = len(side) // 8
+        if side[margin:len(side) - margin].mean() < threshold:
+            return False
+    return True
+
+
+class RegionCache:
+    """
+    Remembers the mini-map region found for every map and window size in a small JSON file.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.regions = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.regions = json.load(f)
+            except (OSError, ValueError):
+                print(f"Could not read {path}, mini-map regions will be searched for again.")
+
+    @staticmethod
+    def key(map_name, shape):
+        return f"{map_name}@{shape[1]}x{shape[0]}"
+
+    def get(self, map_name, shape):
+        region = self.regions.get(self.key(map_name, shape))
+        return tuple(region) if region is not None else None
+
+    def put(self, map_name, shape, region):
+        self.regions[self.key(map_name, shape)] = list(region)
+        if self.path is None:
+            return
+        write_json_atomic(self.path, self.regions, indent=2, sort_keys=True)
@@ -0,0 +1,301 @@
+import heapq
+import itertools
+import json
+import math
+import os
+import threading
+from collections import namedtuple
+from jsonfile import write_json_atomic
+
+# Where the graph learned for every map is remembered across runs.
+NAVIGATION_PATH = "navigation_graphs.json"
+# A dot that keeps its height within HEIGHT_TOLERANCE pixels for GROUND_TIME seconds is standing on a platform,
+# unless it was lower right before, i.e. at the top of a jump.
+GROUND_TIME = 0.15
+HEIGHT_TOLERANCE = 0.5
+# Standing positions at most PLATFORM_GAP pixels past the end of a platform of the same height extend it.
+PLATFORM_GAP = 6
+# Transitions of the same kind that start within this many pixels of each other are only learned once.
+TAKEOFF_BUCKET = 8
+# Observations further apart than this many seconds are not connected, e.g. between two calls of go_to.
+MAX_GAP = 0.5
+# An action only explains the player leaving a platform within this many seconds of being performed.
+ACTION_WINDOW = 1.0
+# The walking speed in mini-map pixels per second until it has been measured, and an upper bound of any speed of
+# the dot, which keeps the A* heuristic from overestimating.
+WALK_SPEED = 30.0
+MAX_SPEED = 300.0
+# Learned graphs are written to disk at most this often, in seconds, by a background thread.
+SAVE_INTERVAL = 5.0
+
+# A horizontal stretch the player has stood on, at height y from x1 to x2.
+Platform = namedtuple("Platform", ["y", "x1", "x2"])
+# Performing action at x on the source platform landed the player at landing_x on the target platform.
+# "walk" means the player walked off the edge, the other actions are those of Player.perform().
+Transition = namedtuple("Transition", ["source", "target", "x", "landing_x", "action", "duration"])
+# A movement primitive of a path: walk to (x, y), then perform action to land around landing.
+Step = namedtuple("Step", ["x", "y", "action", "landing"])
+
+
+class NavigationGraph:
+    """
+    Learns the platforms of a map and the transitions between them from the positions of the player over time,
+    and plans the quickest known path to a target with A*.
+    Platforms are where the dot holds its height, a transition is recorded whenever the player leaves one platform and
+    lands on another, together with the action that made it leave and how long it took. The graph of every map is
+    kept in a small JSON file, so a map only has to be learned once.
+    """
+
+    def __init__(self, map_name="default", path=NAVIGATION_PATH):
+        self.map_name = map_name
+        self.path = path
+        self.platforms = []
+        self.transitions = {}
+        self.walk_speed = WALK_SPEED
+        self.dirty = False
+        self._recent = []
+        self._before = None
+        self._standing = None
+        self._left = None
+        self._action = None
+        self._saved = None
+        # The graph waiting to be written by the writer thread, only the newest one is kept.
+        self._pending = None
+        self._condition = threading.Condition()
+        self._writer = None
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                graph = json.load(f).get(self.map_name)
+        except (OSError, ValueError):
+            print(f"Could not read {self.path}, the map will be learned again.")
+            return
+        if graph is None:
+            return
+        self.platforms = [Platform(*p) for p in graph["platforms"]]
+        for t in graph["transitions"]:
+            self._learn(Transition(*t))
+        self.walk_speed = graph.get("walk_speed", WALK_SPEED)
+        self.dirty = False
+
+    def save(self):
+        """
+        Writes the graph of this map to the JSON file, next to those of the other maps.
+        """
+        self._write(self._graph())
+        self.dirty = False
+
+    def save_later(self):
+        """
+        Has the graph of this map written by a background thread, so the caller does not wait on the disk.
+        """
+        with self._condition:
+            self._pending = self._graph()
+            self._condition.notify()
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_pending, name="navigation-writer", daemon=True)
+                self._writer.start()
+        self.dirty = False
+
+    def _graph(self):
+        return {
+            "platforms": [list(p) for p in self.platforms],
+            "transitions": [list(t) for t in self.transitions.values()],
+            "walk_speed": self.walk_speed,
+        }
+
+    def _write_pending(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                graph, self._pending = self._pending, None
+            try:
+                self._write(graph)
+            except OSError as e:
+                print(f"Could not write {self.path}: {e!r}")
+
+    def _write(self, graph):
+        graphs = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    graphs = json.load(f)
+            except (OSError, ValueError):
+                pass
+        graphs[self.map_name] = graph
+        write_json_atomic(self.path, graphs)
+
+    def act(self, timestamp, action):
+        """
+        Tells the graph the player performed an action, e.g. "drop" or "rope_lift", at a time.perf_counter() time.
+        """
+        self._action = (timestamp, action)
+
+    def observe(self, timestamp, position):
+        """
+        Learns from the position of the player in a frame captured at timestamp, frames must be observed in order.
+        """
+        x, y = position
+        if self._recent and timestamp - self._recent[-1][0] > MAX_GAP:
+            # Whatever happened in between was not seen.
+            self._recent, self._before, self._standing, self._left = [], None, None, None
+        self._recent.append((timestamp, x, y))
+        while len(self._recent) > 2 and timestamp - self._recent[1][0] >= GROUND_TIME:
+            self._before = self._recent.pop(0)[2]
+
+        first = self._recent[0]
+        grounded = (timestamp - first[0] >= GROUND_TIME and all(abs(s[2] - y) <= HEIGHT_TOLERANCE for s in self._recent)
+                    and (self._before is None or self._before <= y))
+        if grounded:
+            platform = self._ground(x, y)
+            if self._standing is not None:
+                _, last_time, last_x = self._standing
+                if last_time != timestamp and x != last_x:
+                    speed = abs(x - last_x) / (timestamp - last_time)
+                    if speed > 1:
+                        self.walk_speed = 0.9 * self.walk_speed + 0.1 * speed
+            if self._left is not None:
+                source, left_time, left_x = self._left
+                if source != platform and abs(self.platforms[source].y - self.platforms[platform].y) <= HEIGHT_TOLERANCE:
+                    # Jumping along a platform lands further down the same platform.
+                    platform = self._join(self._merge(source, platform))
+                elif source != platform:
+                    # The dot settled GROUND_TIME after it actually landed.
+                    self._learn(Transition(source, platform, left_x, x, self._action_since(left_time),
+                                           max(0.0, first[0] - left_time)))
+                self._left, self._action = None, None
+            self._standing = (platform, timestamp, x)
+        elif self._standing is not None:
+            self._left = (self._standing[0], self._standing[1], self._standing[2])
+            self._standing = None
+
+        if self.dirty and self.path is not None and (self._saved is None or timestamp - self._saved >= SAVE_INTERVAL):
+            self._saved = timestamp
+            self.save_later()
+
+    def _action_since(self, timestamp):
+        if self._action is not None and self._action[0] >= timestamp - ACTION_WINDOW:
+            return self._action[1]
+        return "walk"
+
+    def _ground(self, x, y):
+        """
+        Returns the index of the platform the player stands on at (x, y), extending or adding one as needed.
+        """
+        near = [
+            i for i, p in enumerate(self.platforms)
+            if abs(p.y - y) <= HEIGHT_TOLERANCE and p.x1 - PLATFORM_GAP <= x <= p.x2 + PLATFORM_GAP
+        ]
+        if not near:
+            self.platforms.append(Platform(y, x, x))
+            self.dirty = True
+            return len(self.platforms) - 1
+        i = near[0]
+        p = self.platforms[i]
+        if not p.x1 <= x <= p.x2:
+            self.platforms[i] = Platform(p.y, min(p.x1, x), max(p.x2, x))
+            self.dirty = True
+        return self._join(i)
+
+    def _join(self, i):
+        """
+        Merges every platform at the height of platform i that overlaps it into it, returns its index afterwards.
+        Walking or jumping from one known stretch of a platform onto another shows they are the same platform.
+        """
+        while True:
+            p = self.platforms[i]
+            j = next((
+                j for j, q in enumerate(self.platforms)
+                if j != i and abs(q.y - p.y) <= HEIGHT_TOLERANCE and q.x1 - PLATFORM_GAP <= p.x2 and p.x1 <= q.x2 + PLATFORM_GAP
+            ), None)
+            if j is None:
+                return i
+            i = self._merge(i, j)
+
+    def _merge(self, a, b):
+        """
+        Merges platform b into platform a, returns the index of the merged platform.
+        """
+        p, q = self.platforms[a], self.platforms[b]
+        self.platforms[a] = Platform(p.y, min(p.x1, q.x1), max(p.x2, q.x2))
+        del self.platforms[b]
+
+        def index(i):
+            i = a if i == b else i
+            return i - 1 if i > b else i
+
+        transitions, self.transitions = self.transitions.values(), {}
+        for t in transitions:
+            t = t._replace(source=index(t.source), target=index(t.target))
+            if t.source != t.target:
+                self._learn(t)
+        if self._standing is not None:
+            self._standing = (index(self._standing[0]),) + self._standing[1:]
+        if self._left is not None:
+            self._left = (index(self._left[0]),) + self._left[1:]
+        self.dirty = True
+        return index(a)
+
+    def _learn(self, transition):
+        key = (transition.source, transition.target, transition.action, round(transition.x / TAKEOFF_BUCKET))
+        known = self.transitions.get(key)
+        if known is None or transition.duration < known.duration:
+            self.transitions[key] = transition
+            self.dirty = True
+
+    def platform_at(self, position, reach=PLATFORM_GAP):
+        """
+        Returns the index of the platform within reach pixels of the height of a position that is closest to it, or None.
+        Only part of a platform may have been stood on, so positions past either end still count as on it.
+        """
+        x, y = position
+        best, distance = None, None
+        for i, p in enumerate(self.platforms):
+            if abs(p.y - y) > reach:
+                continue
+            d = (max(p.x1 - x, x - p.x2, 0), abs(p.y - y))
+            if distance is None or d < distance:
+                best, distance = i, d
+        return best
+
+    def plan(self, start, goal):
+        """
+        Returns the quickest known path from start to goal as a list of Steps and the seconds it is expected to take,
+        or None if the player has never been seen getting from one's platform to the other's.
+        The path ends on goal's platform, walking to goal itself is left to the caller.
+        """
+        source, target = self.platform_at(start), self.platform_at(goal)
+        if source is None or target is None:
+            return None
+        by_source = {}
+        for t in self.transitions.values():
+            by_source.setdefault(t.source, []).append(t)
+
+        def estimate(x, y):
+            return math.hypot(goal[0] - x, goal[1] - y) / MAX_SPEED
+
+        order = itertools.count()
+        queue = [(estimate(*start), 0.0, next(order), False, source, start[0], [])]
+        visited = set()
+        while queue:
+            _, cost, _, done, platform, x, steps = heapq.heappop(queue)
+            if done:
+                return steps, cost
+            state = (platform, round(x))
+            if state in visited:
+                continue
+            visited.add(state)
+            if platform == target:
+                walk = cost + abs(goal[0] - x) / self.walk_speed
+                heapq.heappush(queue, (walk, walk, next(order), True, platform, goal[0], steps))
+                continue
+            y = self.platforms[platform].y
+            for t in by_source.get(platform, ()):
+                landing = (t.landing_x, self.platforms[t.target].y)
+                total = cost + abs(t.x - x) / self.walk_speed + t.duration
+                heapq.heappush(queue, (total + estimate(*landing), total, next(order), False, t.target, t.landing_x,
+                                       steps + [Step(t.x, y, t.action, landing)]))
+        return None
@@ -1,4 +1,7 @@
 from interception.stroke import key_stroke
+from input_scheduler import InputScheduler
+from polling import Poller, MAX_TICK_RATE
+from profiling import profiler
 import time
 
 # Scancodes for arrow and alphanumeric/modifier keys should be separated. They have different key-states.
@@ -17,89 +20,312 @@ SC_DECIMAL = {
 JUMP_KEY = "ALT"
 ROPE_LIFT_KEY = "D"
 
+# Delay between down-stroke and up-stroke of a key-press, was tested to be around 50 ms.
+PRESS_DURATION = 0.05
+
+# Seconds between queueing a stroke and the dot reacting to it, on top of the age of the frame it was decided on.
+INPUT_LATENCY = 0.05
+# How close, in pixels, the player has to get to the target.
+X_TOLERANCE = 2
+Y_TOLERANCE = 7
+# After a jump, drop or climb, the dot has to keep still for this many seconds before the next decision.
+SETTLE_TIME = 0.2
+# Stop waiting for the dot to settle after this many seconds, e.g. when it keeps sliding down a rope.
+SETTLE_TIMEOUT = 1.5
+# How many times travel() plans a new path after a movement primitive landed the player somewhere unexpected.
+PLAN_ATTEMPTS = 3
+
+
+# The down-stroke and up-stroke of every key are built once, sending a key never allocates a new stroke.
+KEY_STROKES = {key: (key_stroke(code, 2, 0), key_stroke(code, 3, 0)) for key, code in SC_DECIMAL_ARROW.items()}
+KEY_STROKES.update({key: (key_stroke(code, 0, 0), key_stroke(code, 1, 0)) for key, code in SC_DECIMAL.items()})
+
+
+def down_stroke(key):
+    return KEY_STROKES[key][0]
+
+
+def up_stroke(key):
+    return KEY_STROKES[key][1]
+
 
 class Player:
-    def __init__(self, context, device, game):
+    def __init__(self, context, device, game, max_rate=MAX_TICK_RATE, navigation=None, input=None, focus=None):
         self.game = game
+        # The most decisions per second waits on the mini-map make, see Poller.
+        self.max_rate = max_rate
+        # A NavigationGraph learns the map from every position of the player seen, travel() plans paths with it.
+        self.navigation = navigation
         # interception
         self.context = context
         self.device = device
+        # Strokes are sent by a scheduler thread so pressing a key never blocks the caller.
+        # Several players can share one, see supervisor.py, focus() then brings this player's window to the front.
+        self.input = input if input is not None else InputScheduler(self._send)
+        self.focus = focus
+        # The time each key's last queued stroke is sent, later strokes of that key are queued after it.
+        self._key_ready = {}
+
+    def _send(self, strokes):
+        """
+        Sends a tuple of strokes, several strokes go to the driver in a single call.
+        """
+        profiler.count("input.strokes", len(strokes))
+        if self.focus is not None:
+            self.focus()
+        with profiler.time("input"):
+            if len(strokes) == 1:
+                self.context.send(self.device, strokes[0])
+            else:
+                self.context.send_many(self.device, strokes)
+        if self.game.recorder is not None:
+            self.game.recorder.strokes(self.device, strokes)
+
+    def _queue_many(self, keys, strokes, delay=0.0):
+        """
+        Queues strokes of several keys to be sent together, delay seconds after both now and
+        the previously queued strokes of every one of those keys.
+        """
+        deadline = max([time.perf_counter()] + [self._key_ready.get(key, 0.0) for key in keys]) + delay
+        for key in keys:
+            self._key_ready[key] = deadline
+        self.input.schedule(tuple(strokes), deadline, self._send, owner=self)
+
+    def _queue(self, key, stroke, delay=0.0):
+        """
+        Queues a stroke of a key delay seconds after both now and the key's previously queued stroke.
+        """
+        self._queue_many((key,), (stroke,), delay)
+
+    def busy(self, key):
+        """
+        Returns a boolean value based on whether a key still has strokes waiting to be sent.
+        """
+        return self._key_ready.get(key, 0.0) > time.perf_counter()
+
+    def wait(self, timeout=None):
+        """
+        Waits until every stroke this player queued has been sent, for sequences of keys that must happen in strict
+        order. Strokes of other players sharing the scheduler are not waited for.
+        """
+        return self.input.flush(timeout, owner=self)
 
     def release_all(self):
-        for key in SC_DECIMAL_ARROW:
-            self.context.send(self.device, key_stroke(SC_DECIMAL_ARROW[key], 3, 0))
-        for key in SC_DECIMAL:
-            self.context.send(self.device, key_stroke(SC_DECIMAL[key], 1, 0))
+        """
+        Releases every key, keys without queued strokes are released together in a single call to the driver.
+        """
+        now = time.perf_counter()
+        free = [key for key in KEY_STROKES if self._key_ready.get(key, 0.0) <= now]
+        self._queue_many(free, [up_stroke(key) for key in free])
+        for key in KEY_STROKES:
+            if key not in free:
+                self._queue(key, up_stroke(key))
+
+    def chord(self, *keys):
+        """
+        Presses several keys at the same time, e.g. for combos, with one call to the driver for all down-strokes
+        and another for all up-strokes.
+        """
+        self._queue_many(keys, [down_stroke(key) for key in keys])
+        self._queue_many(keys, [up_stroke(key) for key in keys], PRESS_DURATION)
 
-    def press(self, key):
+    def press(self, key, duration=PRESS_DURATION):
         """
-        Mimics a human key-press.
-        Delay between down-stroke and up-stroke was tested to be around 50 ms.
+        Mimics a human key-press, the up-stroke is queued duration seconds after the down-stroke.
+        Returns immediately, presses of the same key are queued one after another.
         """
-        if key in SC_DECIMAL_ARROW:
-            self.context.send(self.device, key_stroke(SC_DECIMAL_ARROW[key], 2, 0))
-            time.sleep(0.05)
-            self.context.send(self.device, key_stroke(SC_DECIMAL_ARROW[key], 3, 0))
-        else:
-            self.context.send(self.device, key_stroke(SC_DECIMAL[key], 0, 0))
-            time.sleep(0.05)
-            self.context.send(self.device, key_stroke(SC_DECIMAL[key], 1, 0))
+        self._queue(key, down_stroke(key))
+        self._queue(key, up_stroke(key), duration)
 
     def release(self, key):
-        if key in SC_DECIMAL_ARROW:
-            self.context.send(self.device, key_stroke(SC_DECIMAL_ARROW[key], 3, 0))
-        else:
-            self.context.send(self.device, key_stroke(SC_DECIMAL[key], 1, 0))
+        self._queue(key, up_stroke(key))
 
     def hold(self, key):
-        if key in SC_DECIMAL_ARROW:
-            self.context.send(self.device, key_stroke(SC_DECIMAL_ARROW[key], 2, 0))
-        else:
-            self.context.send(self.device, key_stroke(SC_DECIMAL[key], 0, 0))
+        self._queue(key, down_stroke(key))
 
-    def go_to(self, target):
+    def steer(self, key):
+        """
+        Holds LEFT or RIGHT, releasing the opposite direction in the same call to the driver.
+        """
+        opposite = "LEFT" if key == "RIGHT" else "RIGHT"
+        self._queue_many((opposite, key), (up_stroke(opposite), down_stroke(key)))
+
+    def perform(self, action):
+        """
+        Performs a vertical movement primitive, "drop" down through a platform, "rope_lift" or "up_jump".
+        """
+        if action == "drop":
+            self.hold("DOWN")
+            self.press(JUMP_KEY)
+            # DOWN is let go once the jump has been pressed.
+            self._queue_many(("DOWN", JUMP_KEY), (up_stroke("DOWN"),), PRESS_DURATION)
+        elif action == "rope_lift":
+            self.press(ROPE_LIFT_KEY)
+        elif action == "up_jump":
+            self.press("UP")
+            self.press("UP")
+        if self.navigation is not None:
+            self.navigation.act(time.perf_counter(), action)
+
+    def _locate(self, frame):
+        """
+        Returns the (x, y) position of the player in a frame, which the navigation graph learns from.
+        """
+        location = self.game.tracker.locate(frame)
+        if self.game.recorder is not None:
+            self.game.recorder.detection(frame.sequence, frame.timestamp, player=location)
+        if location is not None and self.navigation is not None:
+            self.navigation.observe(frame.timestamp, location)
+        return location
+
+    def position(self, timeout=1):
+        """
+        Returns the (x, y) position of the player in the newest frame it can be found in, or None after timeout seconds.
+        """
+        poller = Poller(self.max_rate, timeout)
+        sequence = None
+        found = True
+        while poller.wait(found):
+            found = False
+            frame = self.game.snapshot(newer_than=sequence, timeout=poller.remaining(1))
+            if frame is None:
+                continue
+            sequence = frame.sequence
+            location = self._locate(frame)
+            if location is not None:
+                return location
+        return None
+
+    def wait_until_settled(self, sequence=None, timeout=SETTLE_TIMEOUT):
+        """
+        Waits until the queued strokes were sent and the dot then kept still for SETTLE_TIME seconds,
+        e.g. until the player landed after a jump. Returns the sequence number of the last frame looked at.
+        """
+        self.wait(timeout)
+        start = time.perf_counter()
+        poller = Poller(self.max_rate, timeout)
+        found = True
+        while poller.wait(found):
+            found = False
+            frame = self.game.snapshot(newer_than=sequence, timeout=poller.remaining(1))
+            if frame is None:
+                continue
+            sequence = frame.sequence
+            if self._locate(frame) is None:
+                continue
+            found = True
+            # Frames from before the dot could react to the strokes would look settled right away.
+            if frame.timestamp - start >= INPUT_LATENCY + SETTLE_TIME and self.game.tracker.settled(SETTLE_TIME, 0.5):
+                break
+        return sequence
+
+    def go_to(self, target, frame=None, timeout=None):
         """
         Attempts to move player to a specific (x, y) location on the screen.
+        A Frame already taken this tick can be passed in to skip the first capture.
+        Returns True once the player is there, or False if timeout seconds elapsed first, with every key released.
         """
-        while True:
-            player_location = self.game.get_player_location()
+        sequence = None
+        tracker = self.game.tracker
+        # Pictures without the player dot, e.g. during a map transition, are retried less and less often.
+        poller = Poller(self.max_rate, timeout)
+        found = True
+        while poller.wait(found):
+            found = False
+            if frame is None:
+                # Never decide twice on the same picture of the mini-map.
+                frame = self.game.snapshot(newer_than=sequence, timeout=poller.remaining(1))
+            if frame is None:
+                continue
+            # The dot barely moves between frames, search around where it was instead of the whole mini-map.
+            player_location = self._locate(frame)
+            sequence = frame.sequence
+            # Keys pressed now only take effect this many seconds after the picture was taken.
+            profiler.record("frame.age", frame.age)
+            latency = frame.age + INPUT_LATENCY
+            # Every later iteration needs a fresh picture of the mini-map.
+            frame = None
             if player_location is None:
                 continue
+            found = True
 
             x1, y1 = player_location
             x2, y2 = target
+            # Where the dot will be once keys pressed now take effect, from its velocity over the last frames.
+            vx, _ = tracker.motion()
+            predicted_x = x1 + vx * latency
 
             """
             There are delays between taking a screenshot, processing the image, sending the key press, and game server ping.
-            Player should be within 2 pixels of x-destination and 7 pixels of y-destination.
+            Player should be within X_TOLERANCE pixels of x-destination and Y_TOLERANCE pixels of y-destination.
             """
-            if abs(x1 - x2) < 2:
-                # Player has reached target x-destination, release all held keys.
-                self.release_all()
-                if abs(y2 - y1) < 7:
-                    # Player has reached target y-destination, release all held keys.
+            settle = False
+            with profiler.time("decision"):
+                if abs(x1 - x2) < X_TOLERANCE and abs(predicted_x - x2) < X_TOLERANCE:
+                    # Player has reached target x-destination, release all held keys.
                     self.release_all()
-                    break
-                # Player is above target y-position.
-                elif y1 < y2:
-                    self.hold("DOWN")
-                    self.press(JUMP_KEY)
-                # Player is below target y-position.
+                    if abs(y2 - y1) < Y_TOLERANCE:
+                        return True
+                    # Player is above target y-position.
+                    elif y1 < y2:
+                        self.perform("drop")
+                    # Player is below target y-position.
+                    else:
+                        if y1 - y2 > 30:
+                            self.perform("rope_lift")
+                        else:
+                            self.perform("up_jump")
+                    settle = True
+                elif abs(predicted_x - x2) < X_TOLERANCE:
+                    # Player is still moving but will come to a stop on target, release early instead of overshooting.
+                    self._queue_many(("LEFT", "RIGHT"), (up_stroke("LEFT"), up_stroke("RIGHT")))
                 else:
-                    if y1 - y2 > 30:
-                        self.press(ROPE_LIFT_KEY)
+                    # Player will end up to the left of target x-position.
+                    if predicted_x < x2:
+                        self.steer("RIGHT")
+                    # Player will end up to the right of target x-position.
                     else:
-                        self.press("UP")
-                        self.press("UP")
-                # Delay for player falling down or jumping up.
-                time.sleep(1)
-            else:
-                # Player is to the left of target x-position.
-                if x1 < x2:
-                    self.hold("RIGHT")
-                # Player is to the right of target x-position.
+                        self.steer("LEFT")
+                    # Presses return immediately, only start another double jump once the last one has been sent.
+                    if abs(x2 - x1) > 30 and not self.busy(JUMP_KEY):
+                        self.press(JUMP_KEY)
+                        self.press(JUMP_KEY)
+            if settle:
+                # Wait for player falling down or jumping up to come to rest, rather than for a fixed delay.
+                sequence = self.wait_until_settled(sequence, poller.remaining(SETTLE_TIMEOUT))
+        self.release_all()
+        return False
+
+    def travel(self, target, timeout=None):
+        """
+        Moves the player to target along the quickest path the navigation graph knows of, one movement primitive at a
+        time, planning again whenever a primitive lands the player somewhere else. Targets no path is known to, or
+        without a navigation graph, are left to go_to().
+        Returns True once the player is there, or False if timeout seconds elapsed first.
+        """
+        poller = Poller(self.max_rate, timeout)
+        for _ in range(PLAN_ATTEMPTS if self.navigation is not None else 0):
+            position = self.position(poller.remaining(1))
+            plan = self.navigation.plan(position, target) if position is not None else None
+            if not plan or not plan[0]:
+                break
+            for step in plan[0]:
+                if step.action == "walk":
+                    # Walking towards where the player lands takes it over the edge of the platform.
+                    if not self.go_to(step.landing, timeout=poller.remaining()):
+                        return False
                 else:
-                    self.hold("LEFT")
-                if abs(x2 - x1) > 30:
-                    self.press(JUMP_KEY)
-                    self.press(JUMP_KEY)
+                    if not self.go_to((step.x, step.y), timeout=poller.remaining()):
+                        return False
+                    self.perform(step.action)
+                    # Steer while in the air the way the player did when the transition was learned.
+                    if abs(step.landing[0] - step.x) >= X_TOLERANCE:
+                        self.steer("LEFT" if step.landing[0] < step.x else "RIGHT")
+                    self.wait_until_settled(timeout=poller.remaining(SETTLE_TIMEOUT))
+                    self.release_all()
+                position = self.position(poller.remaining(1))
+                if position is None or self.navigation.platform_at(position) != self.navigation.platform_at(step.landing):
+                    break
+            else:
+                break
+        return self.go_to(target, timeout=poller.remaining())
@@ -0,0 +1,62 @@
+import time
+
+# Decisions are never made more often than this many times per second.
+MAX_TICK_RATE = 60
+# The first retry after a miss waits this many seconds, every further miss doubles it up to MAX_BACKOFF.
+BACKOFF = 0.01
+MAX_BACKOFF = 0.5
+
+
+class Poller:
+    """
+    Paces a loop that waits on the screen, e.g. for the player dot to show up on the mini-map.
+    Iterations are spaced at least 1 / max_rate seconds apart. Consecutive misses, e.g. while the mini-map is hidden
+    during a map transition or a cutscene, back off exponentially, so waiting does not keep a core busy capturing.
+    """
+
+    def __init__(self, max_rate=MAX_TICK_RATE, timeout=None, backoff=BACKOFF, max_backoff=MAX_BACKOFF):
+        self.interval = 1 / max_rate if max_rate else 0.0
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.start = time.perf_counter()
+        self.iterations = 0
+        self.misses = 0
+        self._streak = 0
+        self._last = None
+
+    def remaining(self, limit=None):
+        """
+        Returns the seconds left until the timeout, at most limit, or limit if there is no timeout.
+        """
+        if self.timeout is None:
+            return limit
+        left = max(0.0, self.start + self.timeout - time.perf_counter())
+        return left if limit is None else min(left, limit)
+
+    def expired(self):
+        return self.timeout is not None and time.perf_counter() - self.start >= self.timeout
+
+    def wait(self, hit=True):
+        """
+        Sleeps until the next iteration is due, after a miss if hit is False.
+        Returns False once the timeout elapsed, in which case the loop should give up.
+        """
+        now = time.perf_counter()
+        if self._last is None:
+            delay = 0.0
+        elif hit:
+            self._streak = 0
+            delay = self._last + self.interval - now
+        else:
+            self.misses += 1
+            delay = max(self.interval, min(self.backoff * 2 ** self._streak, self.max_backoff))
+            self._streak += 1
+        left = self.remaining()
+        if left is not None:
+            delay = min(delay, left)
+        if delay > 0:
+            time.sleep(delay)
+        self._last = time.perf_counter()
+        self.iterations += 1
+        return not self.expired()
@@ -0,0 +1,224 @@
+import threading
+import time
+from jsonfile import write_json_atomic
+
+# Every power of two is split into this many buckets, so a recorded latency is off by at most 1 / 2 ** (SUB_BITS - 1).
+SUB_BITS = 5
+HALF = 1 << (SUB_BITS - 1)
+# Latencies are recorded in microseconds, up to about 2 ** MAX_BITS of them, i.e. a few days.
+MAX_BITS = 38
+BUCKETS = (MAX_BITS - SUB_BITS + 2) * HALF
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def bucket_index(value):
+    """
+    Returns the bucket of a non-negative integer, values below 2 ** SUB_BITS get a bucket of their own.
+    """
+    shift = value.bit_length() - SUB_BITS
+    if shift <= 0:
+        return value
+    return min(shift * HALF + (value >> shift), BUCKETS - 1)
+
+
+def bucket_value(index):
+    """
+    Returns the smallest value that falls into a bucket.
+    """
+    if index < 2 * HALF:
+        return index
+    shift = index // HALF - 1
+    return (index - shift * HALF) << shift
+
+
+class Histogram:
+    """
+    Counts latencies in logarithmically sized buckets, in the manner of HdrHistogram.
+    Recording is a handful of integer operations and memory never grows, however many values are recorded.
+    Values can be recorded from several threads at once.
+    """
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def record(self, value):
+        """
+        Records a latency in microseconds.
+        """
+        value = max(0, int(value))
+        index = bucket_index(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, percent):
+        """
+        Returns the value below which percent of the recorded values fall, or None if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                # The middle of the bucket, but never past the largest value recorded.
+                low, high = bucket_value(index), bucket_value(index + 1)
+                return min((low + high - 1) / 2, self.max)
+        return self.max
+
+    def copy(self):
+        """
+        Returns a copy of the histogram that no other thread records into.
+        """
+        histogram = Histogram()
+        with self._lock:
+            histogram.counts = list(self.counts)
+            histogram.count, histogram.total, histogram.min, histogram.max = self.count, self.total, self.min, self.max
+        return histogram
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_us": self.total / self.count if self.count else None,
+            "min_us": self.min,
+            "max_us": self.max if self.count else None,
+            **{f"p{p:g}_us": self.percentile(p) for p in PERCENTILES},
+        }
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record((time.perf_counter_ns() - self.start) // 1000)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Profiler:
+    """
+    Collects a latency Histogram per stage of a tick, e.g. capture, parse, decision and input, and named counters.
+    It is disabled by default, timing a stage then costs a method call and returns a shared no-op context manager.
+    Stages can be timed and counters counted from any thread.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+        # Guards adding stages and counters, and updating counters.
+        self._lock = threading.Lock()
+        self._dumper = None
+        self._stop = threading.Event()
+
+    def time(self, stage):
+        """
+        Returns a context manager recording how long its block took under stage.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self._histogram(stage))
+
+    def record(self, stage, seconds):
+        """
+        Records a latency measured by the caller, e.g. the age of a frame when it is decided on.
+        """
+        if self.enabled:
+            self._histogram(stage).record(seconds * 1e6)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+            self.started = time.time()
+
+    def _histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def dump(self):
+        """
+        Returns every histogram and counter as a dict that can be serialized to JSON.
+        """
+        with self._lock:
+            started = self.started
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        return {
+            "started": started,
+            "time": time.time(),
+            "stages": {stage: h.copy().to_dict() for stage, h in sorted(histograms)},
+            "counters": dict(sorted(counters)),
+        }
+
+    def write(self, path):
+        """
+        Writes dump() to a JSON file, replacing it in a single step.
+        """
+        write_json_atomic(path, self.dump(), indent=2)
+
+    def enable(self, path=None, interval=10.0):
+        """
+        Starts profiling and, given a path, writes the histograms to it every interval seconds until disable().
+        """
+        self.enabled = True
+        if path is not None and self._dumper is None:
+            self._stop.clear()
+            self._dumper = threading.Thread(target=self._dump_every, args=(path, interval), name="profiler",
+                                            daemon=True)
+            self._dumper.start()
+
+    def disable(self):
+        self.enabled = False
+        if self._dumper is not None:
+            self._stop.set()
+            self._dumper.join()
+            self._dumper = None
+
+    def _dump_every(self, path, interval):
+        while not self._stop.wait(interval):
+            self.write(path)
+        self.write(path)
+
+
+# The profiler every module reports to.
+profiler = Profiler()
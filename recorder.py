@@ -0,0 +1,396 @@
+import contextlib
+import json
+import mmap
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import deque, namedtuple
+import numpy as np
+from capture import FrameSource
+from game import Game
+from player import Player
+from interception import interception, mock_backend
+from interception.stroke import key_stroke, mouse_stroke
+from profiling import profiler
+
+# A recording starts with MAGIC and the format version, followed by records, each a RECORD_HEADER of its kind, flags,
+# the length of its JSON meta, the sequence number of the picture it belongs to, its time.perf_counter() timestamp and
+# the length of its payload, then the meta and the payload. The file is grown in CHUNK_SIZE steps and zero-filled
+# past the last record, a record of kind 0 marks the end of a recording that was not closed.
+MAGIC = b"MBFLIGHT"
+VERSION = 1
+FILE_HEADER = struct.Struct("<8sI")
+RECORD_HEADER = struct.Struct("<BBHIdI")
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# Kinds of records.
+SESSION = 1
+MINIMAP = 2
+RUNE = 3
+DETECTION = 4
+STROKES = 5
+# The payload is compressed with zlib.
+COMPRESSED = 1
+# The mini-map is identical to the one of the previous MINIMAP record and has no payload.
+REPEAT = 2
+
+# Records waiting to be written never take more than this many bytes, records beyond that are dropped.
+MAX_QUEUED_BYTES = 32 * 1024 * 1024
+# Every queued record counts as this many bytes on top of its payload, so records without one are bounded too.
+RECORD_OVERHEAD = 256
+
+# A record read back from a recording, data is a BGRA picture, a list of strokes or None for detections.
+Record = namedtuple("Record", ["kind", "sequence", "timestamp", "meta", "data"])
+
+
+class FlightRecorder:
+    """
+    Records the mini-maps, rune pictures, detections and strokes of a session into an append-only file that is
+    memory-mapped for writing, so a crash loses nothing the process already wrote.
+    Recording only copies the data and queues it, a background thread encodes and writes it. A mini-map identical
+    to the last one is written as a repeat of it, others are compressed. The queue is bounded by MAX_QUEUED_BYTES,
+    when the writer falls behind, records are dropped rather than slowing the bot down. When writing fails, e.g. on a
+    full disk, the error is kept in self.error and every further record is dropped.
+    """
+
+    def __init__(self, path, max_queued=MAX_QUEUED_BYTES, compress=True):
+        self.path = path
+        self.max_queued = max_queued
+        self.compress = compress
+        self.written = 0
+        self.dropped = 0
+        self.error = None
+        self._queue = deque()
+        self._queued = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._last_minimap = None
+        self._file = open(path, "w+b")
+        self._file.truncate(CHUNK_SIZE)
+        self._map = mmap.mmap(self._file.fileno(), CHUNK_SIZE)
+        self._offset = 0
+        self._write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._encode(SESSION, 0, time.perf_counter(), {"time": time.time()})
+        self._thread = threading.Thread(target=self._run, name="flight-recorder", daemon=True)
+        self._thread.start()
+
+    def minimap(self, frame):
+        """
+        Records the mini-map of a Frame.
+        """
+        image = np.array(frame.minimap)
+        meta = {"region": list(frame.region), "window": list(frame.image.shape)}
+        self._put((MINIMAP, frame.sequence, frame.timestamp, meta, image), image.nbytes)
+
+    def rune(self, img, sequence, roi, timestamp=None):
+        """
+        Records a picture of the ((row1, row2), (column1, column2)) region of interest runes appear in.
+        """
+        timestamp = time.perf_counter() if timestamp is None else timestamp
+        image = np.array(img)
+        self._put((RUNE, sequence, timestamp, {"roi": [list(r) for r in roi]}, image), image.nbytes)
+
+    def detection(self, sequence, timestamp, **values):
+        """
+        Records what was detected on the picture with a sequence number, e.g. detection(s, t, player=(x, y)).
+        """
+        self._put((DETECTION, sequence, timestamp, values, None), 0)
+
+    def strokes(self, device, strokes):
+        """
+        Records strokes as they are sent to a device.
+        """
+        data = b"".join(s.data for s in strokes)
+        meta = {"device": device, "mouse": isinstance(strokes[0], mouse_stroke)} if strokes else {"device": device}
+        self._put((STROKES, 0, time.perf_counter(), meta, data), len(data))
+
+    def _put(self, record, size):
+        size += RECORD_OVERHEAD
+        with self._condition:
+            if self._closed or self.error is not None or self._queued + size > self.max_queued:
+                self.dropped += 1
+                profiler.count("recorder.dropped")
+                return
+            self._queue.append((record, size))
+            self._queued += size
+            self._condition.notify()
+
+    def close(self):
+        """
+        Writes whatever is still queued and truncates the file to the records written.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        # A failed resize leaves the file unmapped.
+        if not self._map.closed:
+            self._map.flush()
+            self._map.close()
+        self._file.truncate(self._offset)
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        try:
+            self._write_queued()
+        except Exception as e:
+            print(f"Recording to {self.path} failed, nothing more is recorded: {e!r}")
+            with self._condition:
+                self.error = e
+                self.dropped += len(self._queue)
+                self._queue.clear()
+                self._queued = 0
+
+    def _write_queued(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                record, size = self._queue.popleft()
+                self._queued -= size
+            kind, sequence, timestamp, meta, data = record
+            flags = 0
+            if kind == MINIMAP:
+                if self._last_minimap is not None and np.array_equal(data, self._last_minimap):
+                    flags, payload = REPEAT, b""
+                else:
+                    self._last_minimap = data
+                    payload = data.tobytes()
+                meta["shape"] = list(data.shape)
+            elif kind == RUNE:
+                payload = data.tobytes()
+                meta["shape"] = list(data.shape)
+            else:
+                payload = data or b""
+            if self.compress and kind in (MINIMAP, RUNE) and payload:
+                flags, payload = flags | COMPRESSED, zlib.compress(payload, 1)
+            self._encode(kind, sequence, timestamp, meta, payload, flags)
+
+    def _encode(self, kind, sequence, timestamp, meta, payload=b"", flags=0):
+        # Detections may hold numpy numbers, e.g. the positions of rune arrows.
+        meta = json.dumps(meta, separators=(",", ":"), default=lambda o: o.item()).encode()
+        self._write(RECORD_HEADER.pack(kind, flags, len(meta), sequence, timestamp, len(payload)) + meta + payload)
+        self.written += 1
+
+    def _write(self, data):
+        end = self._offset + len(data)
+        if end > len(self._map):
+            # The file cannot be resized while it is mapped on every platform, it is mapped again instead.
+            size = len(self._map) + max(CHUNK_SIZE, len(data))
+            self._map.flush()
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        self._map[self._offset:end] = data
+        self._offset = end
+
+
+class FlightRecording:
+    """
+    Reads a recording of a FlightRecorder. Only the headers are read up front, records are decoded when asked for.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a flight recording.")
+        if version != VERSION:
+            raise ValueError(f"{path} was recorded with version {version}, version {VERSION} is supported.")
+        # The (kind, flags, sequence, timestamp, meta offset, meta length, payload length) of every record.
+        self.index = []
+        offset = FILE_HEADER.size
+        while offset + RECORD_HEADER.size <= len(self._map):
+            kind, flags, meta_length, sequence, timestamp, length = RECORD_HEADER.unpack_from(self._map, offset)
+            offset += RECORD_HEADER.size
+            if kind == 0 or offset + meta_length + length > len(self._map):
+                # The end of a recording that was not closed.
+                break
+            self.index.append((kind, flags, sequence, timestamp, offset, meta_length, length))
+            offset += meta_length + length
+        # A repeated mini-map is decoded from the record it repeats.
+        self._repeats = {}
+        last = None
+        for i, (kind, flags, *_) in enumerate(self.index):
+            if kind == MINIMAP:
+                if flags & REPEAT:
+                    self._repeats[i] = last
+                else:
+                    last = i
+
+    def __len__(self):
+        return len(self.index)
+
+    def indices(self, kind):
+        return [i for i, entry in enumerate(self.index) if entry[0] == kind]
+
+    def record(self, i):
+        """
+        Returns the i-th record of the recording as a Record.
+        """
+        kind, flags, sequence, timestamp, offset, meta_length, length = self.index[i]
+        meta = json.loads(self._map[offset:offset + meta_length])
+        data = None
+        if kind in (MINIMAP, RUNE):
+            source = self._repeats.get(i, i)
+            if source is None:
+                return Record(kind, sequence, timestamp, meta, None)
+            _, source_flags, _, _, offset, meta_length, length = self.index[source]
+            payload = self._map[offset + meta_length:offset + meta_length + length]
+            if source_flags & COMPRESSED:
+                payload = zlib.decompress(payload)
+            data = np.frombuffer(payload, dtype=np.uint8).reshape(meta["shape"])
+        elif kind == STROKES:
+            parser = mouse_stroke if meta.get("mouse") else key_stroke
+            payload = self._map[offset + meta_length:offset + meta_length + length]
+            size = struct.calcsize(parser.fmt)
+            data = [parser.parse(payload[j:j + size]) for j in range(0, len(payload), size)]
+        return Record(kind, sequence, timestamp, meta, data)
+
+    def records(self, *kinds):
+        """
+        Yields every record, or those of the given kinds, in the order they were written.
+        """
+        for i, entry in enumerate(self.index):
+            if not kinds or entry[0] in kinds:
+                yield self.record(i)
+
+    def close(self):
+        self._map.close()
+
+
+class RecordingSource(FrameSource):
+    """
+    Replays the mini-maps and rune pictures of a recording in place of the application window. The rest of the
+    window was not recorded and is black.
+    With a speed, pictures are handed out as they would have appeared in real time scaled by that factor.
+    With speed=None, every grab() advances to the next picture so recordings can be processed as fast as possible.
+    """
+
+    def __init__(self, recording, speed=1.0):
+        self.recording = recording
+        self.speed = speed
+        self.minimaps = recording.indices(MINIMAP)
+        if not self.minimaps:
+            raise ValueError(f"No mini-maps found in {recording.path}.")
+        self.runes = recording.indices(RUNE)
+        self.timestamps = np.array([recording.index[i][3] for i in self.minimaps])
+        first = recording.record(self.minimaps[0])
+        self.region = tuple(first.meta["region"])
+        self.image = np.zeros(first.meta["window"], dtype=np.uint8)
+        self.position = -1
+        self._rune = -1
+        self._start = None
+
+    @property
+    def ended(self):
+        return self.position >= len(self.minimaps) - 1
+
+    @property
+    def sequence(self):
+        """
+        The sequence number the picture returned by the last grab() was recorded with.
+        """
+        return self.recording.index[self.minimaps[self.position]][2] if self.position >= 0 else None
+
+    def _due(self):
+        if self.speed is None:
+            return min(self.position + 1, len(self.minimaps) - 1)
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        elapsed = (now - self._start) * self.speed + self.timestamps[0]
+        return max(0, int(np.searchsorted(self.timestamps, elapsed, side="right")) - 1)
+
+    @contextlib.contextmanager
+    def grab(self):
+        position = self._due()
+        if position != self.position:
+            self.position = position
+            record = self.recording.record(self.minimaps[position])
+            if record.data is not None:
+                top, left, bottom, right = record.meta["region"]
+                self.image[left:right, top:bottom] = record.data
+            # The last rune picture taken before this mini-map.
+            timestamp = record.timestamp
+            while self._rune + 1 < len(self.runes) and self.recording.index[self.runes[self._rune + 1]][3] <= timestamp:
+                self._rune += 1
+                rune = self.recording.record(self.runes[self._rune])
+                (r1, r2), (c1, c2) = rune.meta["roi"]
+                self.image[r1:r2, c1:c2] = rune.data
+        yield self.image
+
+
+def replay(path, speed=None):
+    """
+    Replays a recording through Game and Player and returns how it went as a dict.
+    Every recorded mini-map is parsed again and the player location compared with the one recorded, and the recorded
+    strokes are sent again through the Player's InputScheduler to a mock_backend, at their recorded times scaled by
+    speed, or as fast as possible with speed=None. Enable the profiler to time every stage.
+    """
+    recording = FlightRecording(path)
+    source = RecordingSource(recording, speed=None)
+    game = Game(source.region, source=source)
+    backend = mock_backend()
+    player = Player(interception(backend), 1, game)
+    recorded = {}
+    for r in recording.records(DETECTION):
+        if "player" in r.meta:
+            recorded[r.sequence] = tuple(r.meta["player"]) if r.meta["player"] is not None else None
+    strokes = [(r.timestamp, r.data) for r in recording.records(STROKES) if r.data]
+
+    start = time.perf_counter()
+    origin = source.timestamps[0]
+    compared = mismatches = sent = 0
+    for timestamp in source.timestamps:
+        if speed is not None:
+            delay = start + (timestamp - origin) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        # Strokes go out at their recorded times relative to the mini-maps around them.
+        while sent < len(strokes) and strokes[sent][0] <= timestamp:
+            due = start + (strokes[sent][0] - origin) / speed if speed is not None else None
+            player.input.schedule(tuple(strokes[sent][1]), due)
+            sent += 1
+        frame = game.snapshot()
+        location = game.tracker.locate(frame) if frame is not None else None
+        if source.sequence in recorded:
+            compared += 1
+            expected = recorded[source.sequence]
+            if (location is None) != (expected is None) or (
+                    location is not None and max(abs(a - b) for a, b in zip(location, expected)) > 1e-6):
+                mismatches += 1
+    for _, batch in strokes[sent:]:
+        player.input.schedule(tuple(batch))
+    player.input.close()
+    result = {
+        "records": len(recording),
+        "minimaps": len(source.minimaps),
+        "runes": len(source.runes),
+        "compared": compared,
+        "mismatches": mismatches,
+        "strokes": len(backend.timeline),
+        "seconds": time.perf_counter() - start,
+        "recorded_seconds": float(source.timestamps[-1] - origin),
+        "parse_cache": game.parse_cache.stats(),
+    }
+    recording.close()
+    return result
+
+
+if __name__ == "__main__":
+    # python recorder.py session.rec [speed]
+    print(json.dumps(replay(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else None), indent=2))
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import time
+from collections import namedtuple
+from game import OTHER_BGRA
+from player import KEY_STROKES, PRESS_DURATION
+from profiling import profiler
+
+# Where the rotation of the example script in main.py is defined.
+ROTATION_PATH = "rotation.json"
+# The mini-map is checked for runes and other players this many times per second, also while casting.
+CHECK_RATE = 10
+# Give up moving to where a skill has to be cast after this many seconds, and try it again this much later.
+POSITION_TIMEOUT = 10
+POSITION_RETRY = 5.0
+# After the rune handler returned, a rune that is still there is left alone for this many seconds.
+RUNE_RETRY = 10.0
+
+# A skill of the rotation, cast by pressing key, or holding it for hold seconds, facing direction ("LEFT" or "RIGHT")
+# and standing at position (x, y) if given. It can be cast again cooldown seconds later, and nothing else can be cast
+# for cast_time seconds. A buff lasts duration seconds and is only recast once it wore off. Buffs are cast before
+# anything else, other skills by descending priority and then in the order they are defined in.
+Skill = namedtuple("Skill", ["name", "key", "cooldown", "cast_time", "hold", "direction", "position", "buff",
+                             "duration", "priority"])
+SKILL_DEFAULTS = {
+    "cooldown": 0.0, "cast_time": 0.5, "hold": None, "direction": None, "position": None, "buff": False,
+    "duration": 0.0, "priority": 0,
+}
+
+
+def load_rotation(path=ROTATION_PATH):
+    """
+    Returns the skills of a rotation definition file, a JSON object with a list of skills, e.g.
+    {"skills": [{"name": "Attack", "key": "Q", "cooldown": 0, "cast_time": 0.5, "position": [97, 32.5]}]}.
+    Fields left out take the values in SKILL_DEFAULTS.
+    """
+    with open(path) as f:
+        definition = json.load(f)
+    skills = []
+    for i, entry in enumerate(definition["skills"]):
+        unknown = set(entry) - set(Skill._fields)
+        if unknown:
+            raise ValueError(f"Skill {i} of {path} has unknown fields: {', '.join(sorted(unknown))}.")
+        if "key" not in entry:
+            raise ValueError(f"Skill {i} of {path} has no key.")
+        skill = Skill(**{**SKILL_DEFAULTS, "name": entry.get("key"), **entry})
+        if skill.key not in KEY_STROKES:
+            raise ValueError(f"Skill {skill.name} of {path} uses the unknown key {skill.key}.")
+        if skill.direction not in (None, "LEFT", "RIGHT"):
+            raise ValueError(f"Skill {skill.name} of {path} must face LEFT or RIGHT.")
+        if skill.position is not None:
+            skill = skill._replace(position=tuple(skill.position))
+        skills.append(skill)
+    if not skills:
+        raise ValueError(f"{path} defines no skills.")
+    return skills
+
+
+class RotationScheduler:
+    """
+    Casts the skills of a rotation as soon as each of them is off cooldown, instead of sleeping for fixed delays.
+    The scheduler is an asyncio task, the mini-map is checked for runes and other players CHECK_RATE times per second
+    alongside it, and their handlers run between two casts rather than after a whole pass of the rotation.
+    Movement and the handlers block, they run on a worker thread while the checks go on, so the game should be
+    capturing in the background, see Game.start_capture().
+    """
+
+    def __init__(self, player, game, skills, on_rune=None, on_other=None):
+        """
+        on_rune(location) is called with the location of a rune that appeared, e.g. to solve it,
+        on_other(locations) with the (x, y) locations of other players whenever they entered the map, one per color of
+        dot seen, enemies, guild members and buddies, see game.OTHER_BGRA.
+        """
+        self.player = player
+        self.game = game
+        self.skills = list(skills)
+        if not self.skills:
+            raise ValueError("A rotation needs at least one skill.")
+        self.on_rune = on_rune
+        self.on_other = on_other
+        # The time.perf_counter() time each skill can be cast again, by its index, as a skill may be listed twice.
+        self.ready = [0.0] * len(self.skills)
+        self.casts = 0
+        self.started = None
+        self._events = []
+        self._wake = None
+        # Runes are left alone until this time.perf_counter() time, while one is handled and shortly after.
+        self._rune_ignored = 0.0
+        self._others = False
+
+    def actions_per_minute(self):
+        if self.started is None:
+            return 0.0
+        elapsed = time.perf_counter() - self.started
+        return self.casts * 60 / elapsed if elapsed else 0.0
+
+    def next_skill(self, now):
+        """
+        Returns the index of the skill to cast at now, or None if every skill is still on cooldown.
+        """
+        ready = [(not s.buff, -s.priority, i) for i, s in enumerate(self.skills) if self.ready[i] <= now]
+        return min(ready)[2] if ready else None
+
+    async def run(self, duration=None):
+        """
+        Runs the rotation for duration seconds, or until cancelled.
+        """
+        self.started = time.perf_counter()
+        self._wake = asyncio.Event()
+        watcher = asyncio.create_task(self._watch())
+        # The watcher only ends by an error, e.g. when capturing stopped, which then ends the rotation too.
+        watcher.add_done_callback(lambda task: self._wake.set())
+        try:
+            while duration is None or time.perf_counter() - self.started < duration:
+                if watcher.done():
+                    watcher.result()
+                await self._handle_events()
+                now = time.perf_counter()
+                i = self.next_skill(now)
+                if i is None:
+                    # Sleep until the next skill is off cooldown, unless a rune or player shows up first.
+                    delay = min(self.ready) - now
+                    if duration is not None:
+                        delay = min(delay, self.started + duration - now)
+                    await self._idle(delay)
+                    continue
+                await self._cast(i)
+        finally:
+            watcher.cancel()
+            self.player.release_all()
+
+    async def _idle(self, delay):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), max(0.0, delay))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _cast(self, i):
+        skill = self.skills[i]
+        if skill.position is not None:
+            if not await asyncio.to_thread(self.player.travel, skill.position, POSITION_TIMEOUT):
+                print(f"Could not get to {skill.position} to cast {skill.name}.")
+                self.ready[i] = time.perf_counter() + POSITION_RETRY
+                return
+        if skill.direction is not None:
+            # Turning around is a short press of the direction, the skill goes off once it was let go.
+            self.player.press(skill.direction)
+            await asyncio.sleep(PRESS_DURATION)
+        start = time.perf_counter()
+        self.player.press(skill.key, skill.hold if skill.hold is not None else PRESS_DURATION)
+        self.ready[i] = start + max(skill.cooldown, skill.duration if skill.buff else 0.0)
+        self.casts += 1
+        profiler.count("rotation.casts")
+        await asyncio.sleep(max(skill.cast_time, skill.hold or 0.0))
+
+    async def _watch(self):
+        """
+        Checks the newest picture of the mini-map for runes and other players, and wakes the rotation up for them.
+        """
+        while True:
+            frame = self.game.snapshot()
+            if frame is not None:
+                now = time.perf_counter()
+                rune = frame.rune_location
+                if (rune is not None and self.on_rune is not None and now >= self._rune_ignored
+                        and not any(kind == "rune" for kind, _ in self._events)):
+                    self._events.append(("rune", rune))
+                    self._wake.set()
+                others = frame.locate(*OTHER_BGRA) if frame.other_location else []
+                if self.game.recorder is not None:
+                    self.game.recorder.detection(frame.sequence, frame.timestamp, rune=rune, others=others)
+                # Only a player entering the map is reported, not every picture they are in.
+                if others and not self._others and self.on_other is not None:
+                    self._events.append(("other", others))
+                    self._wake.set()
+                self._others = bool(others)
+            await asyncio.sleep(1 / CHECK_RATE)
+
+    async def _handle_events(self):
+        while self._events:
+            kind, value = self._events.pop(0)
+            if kind == "rune":
+                self._rune_ignored = float("inf")
+                await asyncio.to_thread(self.on_rune, value)
+                self._rune_ignored = time.perf_counter() + RUNE_RETRY
+            else:
+                await asyncio.to_thread(self.on_other, value)
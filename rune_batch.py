@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import sys
+import time
+import zipfile
+import cv2 as cv
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from capture import IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, decode_image, to_bgra
+from rune_solver import RUNE_ROI, find_arrow_directions
+
+
+def crop_roi(img):
+    """
+    Returns a copy of the RUNE_ROI part of a picture and the (row, column) of its first pixel,
+    so only the part the search reads is sent to a worker.
+    """
+    (r1, r2), (c1, c2) = RUNE_ROI
+    return np.ascontiguousarray(img[r1:r2, c1:c2]), (r1, c1)
+
+
+def iter_npz_frames(path):
+    """
+    Yields the pictures of the "frames" array of an .npz archive one at a time, reading the archive member
+    as a stream, so the whole array is never held in memory.
+    """
+    with zipfile.ZipFile(path) as archive, archive.open("frames.npy") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran_order:
+            raise ValueError(f"The frames of {path} must be stored in C order.")
+        size = int(np.prod(shape[1:])) * dtype.itemsize
+        for _ in range(shape[0]):
+            data = f.read(size)
+            if len(data) < size:
+                raise ValueError(f"The frames of {path} are truncated.")
+            yield np.frombuffer(data, dtype).reshape(shape[1:])
+
+
+def iter_video_frames(path):
+    """
+    Yields the pictures of a video file one at a time.
+    """
+    video = cv.VideoCapture(path)
+    try:
+        while True:
+            ok, img = video.read()
+            if not ok:
+                break
+            yield to_bgra(img)
+    finally:
+        video.release()
+
+
+def iter_tasks(path):
+    """
+    Yields a (source, name, payload) task for every picture at path without decoding it where possible.
+    The payload is a file path or the encoded bytes of an image, which are decoded by the worker.
+    Pictures of .npz archives and videos are decoded one at a time and sent as their RUNE_ROI part and its origin.
+    """
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    file_path = os.path.join(root, f)
+                    yield path, os.path.relpath(file_path, path), file_path
+    elif path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for f in sorted(archive.namelist()):
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    yield path, f, archive.read(f)
+    elif path.lower().endswith(IMAGE_EXTENSIONS):
+        yield path, os.path.basename(path), path
+    elif path.lower().endswith(".npz"):
+        with np.load(path) as archive:
+            names = list(archive["names"]) if "names" in archive.files else None
+        for i, img in enumerate(iter_npz_frames(path)):
+            yield path, str(names[i]) if names is not None else str(i), crop_roi(img)
+    elif path.lower().endswith(VIDEO_EXTENSIONS):
+        for i, img in enumerate(iter_video_frames(path)):
+            yield path, str(i), crop_roi(img)
+    else:
+        raise ValueError(f"Cannot read pictures from {path}.")
+
+
+def solve_task(task, vectorized=True):
+    """
+    Decodes and solves a single picture, returning its result as a dict.
+    """
+    source, name, payload = task
+    start = time.perf_counter()
+    origin = (0, 0)
+    if isinstance(payload, str):
+        img = cv.imread(payload, cv.IMREAD_UNCHANGED)
+        img = to_bgra(img) if img is not None else None
+    elif isinstance(payload, bytes):
+        img = decode_image(payload)
+    else:
+        img, origin = payload
+    decoded = time.perf_counter()
+    result = {"source": source, "image": name}
+    if img is None:
+        result["error"] = "could not decode image"
+        return result
+
+    stats = {}
+    directions = find_arrow_directions(img, vectorized=vectorized, stats=stats, origin=origin)
+    solved = time.perf_counter()
+    result.update({
+        "directions": [d for d, _ in directions],
+        "positions": [list(p) for _, p in directions],
+        "decode_ms": round((decoded - start) * 1000, 3),
+        "solve_ms": round((solved - decoded) * 1000, 3),
+    })
+    result.update(stats)
+    return result
+
+
+def run(paths, output, workers=None, vectorized=True, backlog=4):
+    """
+    Solves every picture found at paths on a pool of processes and writes one JSON line per picture to output
+    as soon as it is done. Pictures are read one at a time and at most backlog tasks per worker are in flight,
+    so memory stays bounded. A picture that fails is written as a line with its error, the others are still solved.
+    Returns the number of pictures processed.
+    """
+    workers = workers or os.cpu_count()
+    processed = 0
+    with ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        # The source and name of the picture of each pending task, to report its error.
+        names = {}
+
+        def emit(done):
+            nonlocal processed
+            for f in done:
+                source, name = names.pop(f)
+                try:
+                    result = f.result()
+                except Exception as e:
+                    result = {"source": source, "image": name, "error": repr(e)}
+                output.write(json.dumps(result) + "\n")
+                processed += 1
+            output.flush()
+
+        for path in paths:
+            for task in iter_tasks(path):
+                if len(pending) >= workers * backlog:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    emit(done)
+                future = pool.submit(solve_task, task, vectorized)
+                names[future] = task[:2]
+                pending.add(future)
+        emit(wait(pending).done)
+    return processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solves directories or archives of rune pictures in parallel.")
+    parser.add_argument("paths", nargs="+", help="directories, .zip or .npz archives, videos or images to solve")
+    parser.add_argument("--output", help="write JSON lines to this file instead of standard output")
+    parser.add_argument("--workers", type=int, help="number of worker processes, defaults to one per core")
+    parser.add_argument("--pixel", action="store_true", help="use the pixel-by-pixel search")
+    args = parser.parse_args()
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    start = time.perf_counter()
+    try:
+        processed = run(args.paths, output, args.workers, not args.pixel)
+    finally:
+        if args.output:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} images in {elapsed:.2f}s ({processed / max(elapsed, 1e-9):.1f} images/s).",
+          file=sys.stderr)
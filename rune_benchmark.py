@@ -0,0 +1,92 @@
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from capture import load_frames
+from rune_solver import find_arrow_directions
+
+
+def percentiles(latencies):
+    """
+    Returns the p50, p95 and max of a list of latencies in seconds, converted to milliseconds.
+    """
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "max_ms": round(float(latencies.max()), 3),
+    }
+
+
+def benchmark(path, labels, vectorized=True, repeat=5):
+    """
+    Runs find_arrow_directions repeat times over every picture at path and scores it against the labels,
+    a dict mapping picture names to their expected list of directions.
+    Returns a dict of per-image and aggregate results.
+    """
+    frames, _, names = load_frames(path)
+    images, latencies = [], []
+    correct, arrows_correct, arrows_total = 0, 0, 0
+    for name, img in zip(names, frames):
+        timings = []
+        for _ in range(repeat):
+            stats = {}
+            start = time.perf_counter()
+            directions = find_arrow_directions(img, vectorized=vectorized, stats=stats)
+            timings.append(time.perf_counter() - start)
+        latencies.extend(timings)
+
+        found = [d for d, _ in directions]
+        expected = labels.get(name)
+        result = {"image": name, "directions": found, "expected": expected}
+        if expected is not None:
+            result["correct"] = found == expected
+            # Arrows are only comparable position by position when the right number of them was found.
+            matched = sum(a == b for a, b in zip(found, expected)) if len(found) == len(expected) else 0
+            correct += result["correct"]
+            arrows_correct += matched
+            arrows_total += len(expected)
+        result.update(stats)
+        result.update(percentiles(timings))
+        images.append(result)
+
+    labelled = sum(1 for result in images if result["expected"] is not None)
+    aggregate = {
+        "mode": "vectorized" if vectorized else "pixel",
+        "images": len(images),
+        "labelled": labelled,
+        "correct": correct,
+        "accuracy": round(correct / labelled, 4) if labelled else None,
+        "arrow_accuracy": round(arrows_correct / arrows_total, 4) if arrows_total else None,
+        "red_pixels": sum(result["red_pixels"] for result in images),
+        "examined": sum(result["examined"] for result in images),
+    }
+    aggregate.update(percentiles(latencies))
+    return {"aggregate": aggregate, "images": images}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the latency and accuracy of the rune solver.")
+    parser.add_argument("path", nargs="?", default="docs/rune_screenshots",
+                        help="directory of screenshots, .npz archive or video to solve")
+    parser.add_argument("--labels", help="JSON file of expected directions, defaults to labels.json inside path")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs per image")
+    parser.add_argument("--pixel", action="store_true", help="benchmark the pixel-by-pixel search")
+    parser.add_argument("--output", help="write the results to this file instead of standard output")
+    args = parser.parse_args()
+
+    labels_path = args.labels or os.path.join(args.path, "labels.json")
+    labels = {}
+    if os.path.isfile(labels_path):
+        with open(labels_path) as f:
+            labels = json.load(f)
+
+    results = benchmark(args.path, labels, vectorized=not args.pixel, repeat=args.repeat)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -1,19 +1,174 @@
 import cv2 as cv
-import os
+import sys
+import time
 import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from capture import BufferPool, ReplaySource
+from profiling import profiler
 
+# The rune captcha was observed to appear within this part of the application window on 800x600 resolution.
+SEARCH_ROWS = (150, 275)
+SEARCH_COLS = (150, 650)
+# The directional arrows that appear in runes are around 30 pixels long and 15 pixels apart.
+ARROW_LENGTH = 30
+ARROW_SPACING = 15
+# The part of the window the search reads, the search window padded by the length of an arrow, as (rows, columns).
+RUNE_ROI = (
+    (SEARCH_ROWS[0] - ARROW_LENGTH, SEARCH_ROWS[1] + ARROW_LENGTH),
+    (SEARCH_COLS[0] - ARROW_LENGTH, SEARCH_COLS[1] + ARROW_LENGTH),
+)
+RUNE_ORIGIN = (RUNE_ROI[0][0], RUNE_ROI[1][0])
+RUNE_SHAPE = (RUNE_ROI[0][1] - RUNE_ROI[0][0], RUNE_ROI[1][1] - RUNE_ROI[1][0], 4)
+# Directions are tried in this order, each with the (row, column) step taken from the red end of the arrow.
+ARROW_STEPS = (("RIGHT", (0, -1)), ("LEFT", (0, 1)), ("DOWN", (-1, 0)), ("UP", (1, 0)))
+# Every rune has this many arrows, arrows found in different pictures within this many columns are the same arrow.
+RUNE_ARROWS = 4
+ARROW_MATCH_COLS = 2 * ARROW_SPACING
 
-def find_arrow_directions(img, debug=False):
+
+class GradientMap:
+    """
+    An occupancy bitmap of the pixels around the starting pixels of arrows that have been found.
+    Marking an arrow fills its whole suppressed square once, so lookups cost a single byte read no matter
+    how many arrows were found, and a row-major scan can step over a suppressed run of a row at once.
+    """
+
+    def __init__(self, shape, spacing=ARROW_SPACING):
+        self.height, self.width = shape[0], shape[1]
+        self.spacing = spacing
+        self.arrows = []
+        # Rows are only allocated once an arrow suppresses part of them.
+        self.rows = {}
+
+    def __len__(self):
+        return len(self.arrows)
+
+    def add(self, r, c):
+        """
+        Marks every pixel within the spacing of (r, c) in both rows and columns as suppressed.
+        """
+        self.arrows.append((r, c))
+        c1, c2 = max(0, c - self.spacing + 1), min(self.width, c + self.spacing)
+        for i in range(max(0, r - self.spacing + 1), min(self.height, r + self.spacing)):
+            row = self.rows.get(i)
+            if row is None:
+                row = self.rows[i] = bytearray(self.width)
+            row[c1:c2] = b"\x01" * (c2 - c1)
+
+    def near(self, r, c):
+        """
+        Returns a boolean value based on whether or not a pixel is around an arrow that has been found.
+        """
+        row = self.rows.get(r)
+        return row is not None and row[c] != 0
+
+    def skip(self, r, c):
+        """
+        Returns the first column at or after c on row r that is not around an arrow that has been found.
+        """
+        row = self.rows.get(r)
+        if row is None:
+            return c
+        c = row.find(0, c)
+        return c if c >= 0 else self.width
+
+
+def shift(arr, delta_r, delta_c, fill=False):
+    """
+    Returns arr shifted so that out[r][c] = arr[r + delta_r][c + delta_c], padding with fill outside of arr.
+    """
+    m, n = arr.shape
+    out = np.full_like(arr, fill)
+    if abs(delta_r) >= m or abs(delta_c) >= n:
+        return out
+    out[max(0, -delta_r):m - max(0, delta_r), max(0, -delta_c):n - max(0, delta_c)] = \
+        arr[max(0, delta_r):m - max(0, -delta_r), max(0, delta_c):n - max(0, -delta_c)]
+    return out
+
+
+def find_arrows_vectorized(h, s, v, stats=None, origin=(0, 0)):
+    """
+    Finds the same arrows as the pixel-by-pixel search using array operations over the search window.
+    Every red pixel is tested in all four directions at once by walking shifted copies of the HSV planes
+    up to ARROW_LENGTH steps, only the final suppression of nearby arrows visits individual candidates.
+    origin is the (row, column) in the window of the first pixel of the planes.
+    Returns a list of (direction, (r, c)) in the order the pixel-by-pixel search would find them.
+    """
+    m, n = h.shape
+    rows = (max(0, SEARCH_ROWS[0] - origin[0]), SEARCH_ROWS[1] - origin[0])
+    cols = (max(0, SEARCH_COLS[0] - origin[1]), SEARCH_COLS[1] - origin[1])
+    # Gradients may leave the search window, so walk them over a window padded by the length of an arrow.
+    top, bottom = max(0, rows[0] - ARROW_LENGTH), min(m, rows[1] + ARROW_LENGTH)
+    left, right = max(0, cols[0] - ARROW_LENGTH), min(n, cols[1] + ARROW_LENGTH)
+    hue = h[top:bottom, left:right].astype(np.int16)
+    sat, val = s[top:bottom, left:right], v[top:bottom, left:right]
+
+    red = (hue >= 5) & (hue <= 12) & (sat >= 65) & (val >= 128)
+    # A pixel can continue a gradient if it is saturated, bright and not past green.
+    continues = (sat >= 150) & (val >= 150) & (hue <= 70)
+    green = continues & (hue >= 50)
+
+    # Only red pixels inside the search window may start an arrow.
+    window = np.zeros_like(red)
+    window[rows[0] - top:max(0, rows[1] - top), cols[0] - left:max(0, cols[1] - left)] = True
+    starts = red & window
+    if stats is not None:
+        # Every red pixel in the search window has its gradients walked.
+        stats["red_pixels"] = stats["examined"] = int(np.count_nonzero(starts))
+
+    direction_index = np.full(hue.shape, -1, dtype=np.int8)
+    for d, (_, (delta_r, delta_c)) in enumerate(ARROW_STEPS):
+        # step_valid[r][c] holds whether a gradient continues from (r, c) onto the next pixel in this direction.
+        step_valid = shift(continues, delta_r, delta_c) & (np.abs(hue - shift(hue, delta_r, delta_c)) <= 10)
+        # Walks are tracked at their starting pixel, step k compares against planes shifted k pixels along.
+        alive = starts & (direction_index < 0)
+        found = np.zeros_like(alive)
+        for k in range(ARROW_LENGTH):
+            if not alive.any():
+                break
+            valid_k = shift(step_valid, k * delta_r, k * delta_c)
+            green_k = shift(green, (k + 1) * delta_r, (k + 1) * delta_c)
+            # A walk ends successfully on a green pixel and fails on the first invalid step.
+            found |= alive & valid_k & green_k
+            alive &= valid_k & ~green_k
+        direction_index[found] = d
+
+    # Candidates are visited in row-major order, keeping those not within ARROW_SPACING of an arrow already kept.
+    directions = []
+    grid = GradientMap((m, n))
+    for r, c in np.argwhere(direction_index >= 0):
+        d = direction_index[r, c]
+        r, c = int(r) + top, int(c) + left
+        if not grid.near(r, c):
+            grid.add(r, c)
+            directions.append((ARROW_STEPS[d][0], (r + origin[0], c + origin[1])))
+    return directions
+
+
+def find_arrow_directions(img, debug=False, vectorized=True, stats=None, origin=(0, 0)):
     """
     Given an image in BGRA format, will attempt to find "arrows" through
     classifying the directions of gradients that start and end at certain HSV values.
+    The vectorized search finds the same arrows as the original pixel-by-pixel search, which is kept for reference.
+    If a stats dict is given, it is filled with the number of red pixels visited in the search window
+    and the number of those whose gradients were examined.
+    Only the RUNE_ROI part of the image is converted and searched. For an image already cropped, e.g. to RUNE_ROI,
+    origin is the (row, column) in the window of its first pixel. Positions are returned in window coordinates.
     Debugging will show parsed pictures of the image.
     """
+    (r1, r2), (c1, c2) = RUNE_ROI
+    top, left = max(0, r1 - origin[0]), max(0, c1 - origin[1])
+    img = img[top:max(top, r2 - origin[0]), left:max(left, c2 - origin[1])]
+    if img.size == 0:
+        return []
+    # Searching happens in the coordinates of the cropped image, r0 and c0 are its first pixel in the window.
+    r0, c0 = top + origin[0], left + origin[1]
     bgr = cv.cvtColor(img, cv.COLOR_BGRA2BGR)
     hsv = cv.cvtColor(bgr, cv.COLOR_BGR2HSV)
     h, s, v = cv.split(hsv)
     m, n = len(h), len(h[0])
-    valid_gradient = []
+    valid_gradient = GradientMap((m, n))
     directions = []
 
     if debug:
@@ -36,10 +191,7 @@ def find_arrow_directions(img, debug=False):
         """
         Returns a boolean value based on whether or not a certain pixel is around an already discovered gradient.
         """
-        for i, j in valid_gradient:
-            if abs(i-r) < 15 and abs(c-j) < 15:
-                return True
-        return False
+        return valid_gradient.near(r, c)
 
     def gradient_exists(r1, c1, delta_r, delta_c):
         """
@@ -51,7 +203,7 @@ def find_arrow_directions(img, debug=False):
         tmp_r1, tmp_c1 = r1, c1
         rune_gradient = False
         # The directional arrows that appear in runes are around 30 pixels long.
-        for _ in range(30):
+        for _ in range(ARROW_LENGTH):
             r2 = tmp_r1 + delta_r
             c2 = tmp_c1 + delta_c
             if 0 <= r2 < m and 0 <= c2 < n:
@@ -60,7 +212,7 @@ def find_arrow_directions(img, debug=False):
                     # If the pixel is a green-ish color, it is a possible arrow.
                     if 50 <= h[r2][c2] <= 70:
                         rune_gradient = True
-                        valid_gradient.append((r1, c1))
+                        valid_gradient.add(r1, c1)
                         break
                     tmp_r1 = r2
                     tmp_c1 = c2
@@ -109,21 +261,34 @@ def find_arrow_directions(img, debug=False):
         else:
             return None
 
-    # The rune captcha was observed to appear within this part of the application window on 800x600 resolution.
-    for r in range(150, 275):
-        for c in range(150, 650):
-            # Arrows start at a red-ish color and are around 15 pixels apart.
-            if hue_is_red(r, c) and not near_gradient(r, c):
-                direction = find_direction(r, c)
-                if direction:
-                    directions.append((direction, (r, c)))
-                    if debug:
-                        if direction == "LEFT" or direction == "RIGHT":
-                            expand_gradient(r, c, 1)
-                        else:
-                            expand_gradient(r, c, 0)
+    if vectorized:
+        directions = find_arrows_vectorized(h, s, v, stats, (r0, c0))
+    else:
+        red_pixels, examined = 0, 0
+        for r in range(max(0, SEARCH_ROWS[0] - r0), min(m, SEARCH_ROWS[1] - r0)):
+            c = max(0, SEARCH_COLS[0] - c0)
+            while c < min(n, SEARCH_COLS[1] - c0):
+                # Arrows start at a red-ish color and are around 15 pixels apart.
+                if hue_is_red(r, c):
+                    red_pixels += 1
+                    if near_gradient(r, c):
+                        # Step over the rest of the pixels around the arrow that has been found.
+                        c = valid_gradient.skip(r, c)
+                        continue
+                    examined += 1
+                    direction = find_direction(r, c)
+                    if direction:
+                        directions.append((direction, (r + r0, c + c0)))
+                c += 1
+        if stats is not None:
+            stats["red_pixels"], stats["examined"] = red_pixels, examined
 
     if debug:
+        for direction, (r, c) in directions:
+            if direction == "LEFT" or direction == "RIGHT":
+                expand_gradient(r - r0, c - c0, 1)
+            else:
+                expand_gradient(r - r0, c - c0, 0)
         cv.imshow("Hue", h)
         cv.imshow("Saturation", s)
         cv.imshow("Value", v)
@@ -134,8 +299,149 @@ def find_arrow_directions(img, debug=False):
     return sorted(directions, key=lambda x: x[1][1])
 
 
+def solve_source(source, debug=False):
+    """
+    Yields the arrow directions found in every picture taken from a FrameSource, until it runs out of pictures.
+    """
+    while True:
+        with source.grab() as img:
+            if img is None:
+                break
+            yield find_arrow_directions(img, debug)
+
+
+def vote_directions(results, min_votes=2):
+    """
+    Combines the arrows found in several pictures of the same rune.
+    Arrows are grouped by column across pictures and each group votes on its direction.
+    Returns the RUNE_ARROWS voted (direction, (r, c)) sorted by column once exactly that many groups have
+    at least min_votes votes and a strict majority for one direction, otherwise an empty list.
+    """
+    groups = []
+    for directions in results:
+        for direction, (r, c) in directions:
+            for group in groups:
+                if abs(group["col"] - c) < ARROW_MATCH_COLS:
+                    break
+            else:
+                group = {"col": c, "votes": Counter(), "positions": []}
+                groups.append(group)
+            group["votes"][direction] += 1
+            group["positions"].append((r, c))
+
+    voted = []
+    for group in groups:
+        total = sum(group["votes"].values())
+        if total < min_votes:
+            continue
+        direction, votes = group["votes"].most_common(1)[0]
+        if votes * 2 <= total:
+            return []
+        positions = np.array(group["positions"])
+        voted.append((direction, tuple(int(x) for x in np.median(positions, axis=0))))
+    if len(voted) != RUNE_ARROWS:
+        return []
+    return sorted(voted, key=lambda x: x[1][1])
+
+
+class RunePipeline:
+    """
+    Solves a rune from a short burst of pictures instead of a single one.
+    Pictures are searched in parallel by a pool of processes and their arrows combined by vote_directions(),
+    returning as soon as the burst agrees on an answer.
+    Pipelines of several games, e.g. the clients of a Supervisor, can share one pool of processes.
+    """
+
+    def __init__(self, game, workers=None, frames=8, interval=0.1, min_votes=2, pool=None):
+        """
+        Searches on pool if given, which is then left running by close(), or on a pool of workers processes.
+        """
+        self.game = game
+        self.frames = frames
+        self.interval = interval
+        self.min_votes = min_votes
+        # Starting processes is slow, the pool is created once and reused for every rune.
+        self.shared = pool is not None
+        self.pool = pool if pool is not None else ProcessPoolExecutor(workers)
+        # Pictures of RUNE_ROI are taken into buffers reused for every rune, one goes back once its search is done.
+        self.buffers = BufferPool(RUNE_SHAPE, count=frames)
+
+    def close(self):
+        if not self.shared:
+            self.pool.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def solve(self):
+        """
+        Takes up to self.frames pictures self.interval seconds apart and returns the voted directions.
+        If the burst never agrees, falls back to the last picture that found every arrow on its own.
+        """
+        with profiler.time("rune.solve"):
+            directions, sequence = self._solve()
+        if self.game.recorder is not None:
+            self.game.recorder.detection(sequence, time.perf_counter(), arrows=directions)
+        return directions
+
+    def _solve(self):
+        """
+        Returns the directions and the sequence number of the newest picture they were decided on.
+        """
+        pending, results = set(), []
+        # The sequence number of the picture each search is for, and of the newest one whose result is counted.
+        sequences = {}
+        solved = 0
+        sequence = 0
+        deadline = time.perf_counter()
+        for _ in range(self.frames):
+            # Only the part of the picture the search can reach is copied, and sent over to the workers.
+            img = self.buffers.acquire()
+            captured = self.game.capture_roi(RUNE_ROI, img, newer_than=sequence)
+            if captured is None:
+                self.buffers.release(img)
+            else:
+                sequence = captured
+                future = self.pool.submit(find_arrow_directions, img, origin=RUNE_ORIGIN)
+                # The arguments have been sent to the worker by the time its result is back, or never if cancelled.
+                future.add_done_callback(lambda f, img=img: self.buffers.release(img))
+                sequences[future] = captured
+                pending.add(future)
+
+            # Collect whatever the workers finish while waiting for the next picture.
+            deadline += self.interval
+            while True:
+                remaining = max(0, deadline - time.perf_counter())
+                if not pending:
+                    time.sleep(remaining)
+                    break
+                done, pending = wait(pending, remaining, FIRST_COMPLETED)
+                if not done:
+                    break
+                for f in done:
+                    results.append((f.result(), sequences[f]))
+                    solved = max(solved, sequences[f])
+                directions = vote_directions([d for d, _ in results], self.min_votes)
+                if directions:
+                    for f in pending:
+                        f.cancel()
+                    return directions, solved
+
+        for f in as_completed(pending):
+            results.append((f.result(), sequences[f]))
+            solved = max(solved, sequences[f])
+            directions = vote_directions([d for d, _ in results], self.min_votes)
+            if directions:
+                return directions, solved
+        return next(((d, s) for d, s in reversed(results) if len(d) == RUNE_ARROWS), ([], solved))
+
+
 if __name__ == "__main__":
-    for file_name in os.listdir("docs/rune_screenshots"):
-        if file_name.endswith(".png"):
-            img = cv.imread("docs/rune_screenshots/" + file_name)
-            print(f'File:{file_name}, Directions={find_arrow_directions(img, True)}')
+    # Accepts a directory of screenshots, an .npz archive or a video recording of the application window.
+    path = sys.argv[1] if len(sys.argv) > 1 else "docs/rune_screenshots"
+    source = ReplaySource(path, speed=None, loop=False)
+    for directions in solve_source(source, debug=True):
+        print(f'File:{source.name}, Directions={directions}')
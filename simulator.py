@@ -0,0 +1,307 @@
+import contextlib
+import threading
+import time
+import numpy as np
+from collections import namedtuple
+from capture import FrameSource
+from game import Game, PLAYER_BGRA, RUNE_BGRA, ENEMY_BGRA
+from player import Player, SC_DECIMAL_ARROW, SC_DECIMAL, JUMP_KEY, ROPE_LIFT_KEY
+from interception import interception, mock_backend
+
+# Platforms are horizontal (y, x1, x2) lines the player stands on, ropes are vertical (x, y1, y2) lines to climb.
+SimulatedMap = namedtuple("SimulatedMap", ["width", "height", "platforms", "ropes"])
+
+# A map roughly shaped like the mini-map of the example script in main.py, the last platform is the ground.
+EXAMPLE_MAP = SimulatedMap(
+    width=175, height=70,
+    platforms=[(15, 20, 80), (32, 60, 135), (52, 0, 174)],
+    ropes=[(40, 15, 52), (110, 32, 52)],
+)
+
+# A map whose top platform is out of reach of a rope lift from the ground, it is only reached through the one in the
+# middle, so moving towards the target and then straight up never gets there.
+LEDGE_MAP = SimulatedMap(
+    width=175, height=70,
+    platforms=[(12, 20, 90), (44, 70, 160), (64, 0, 174)],
+    ropes=[],
+)
+
+# Colors used to draw the mini-map, they must not collide with the colors Game looks for.
+BACKGROUND_BGRA = (40, 40, 40, 255)
+PLATFORM_BGRA = (180, 180, 180, 255)
+ROPE_BGRA = (90, 130, 160, 255)
+# The light gray frame around the mini-map, which Game finds the mini-map by.
+FRAME_BGRA = (221, 221, 221, 255)
+
+# Movement speeds in mini-map pixels per second.
+WALK_SPEED = 36.0
+CLIMB_SPEED = 24.0
+JUMP_SPEED = 60.0
+DOUBLE_JUMP_SPEED = 90.0
+UP_JUMP_SPEED = 110.0
+ROPE_LIFT_SPEED = 150.0
+GRAVITY = 240.0
+# Pressing UP twice within this many seconds while standing away from a rope jumps upwards.
+UP_JUMP_WINDOW = 0.5
+# The player dot is drawn as a square of this many pixels, centered on the player.
+DOT_SIZE = 4
+
+# Scancodes of the keys the simulated player reacts to.
+KEY_NAMES = {code: key for key, code in SC_DECIMAL_ARROW.items()}
+KEY_NAMES.update({code: key for key, code in SC_DECIMAL.items()})
+
+
+class MinimapSimulator(FrameSource):
+    """
+    Simulates the player dot moving on a mini-map in response to the strokes sent to a mock_backend.
+    Every grab() renders a BGRA picture of the application window with the mini-map at the position Game expects,
+    so the simulator stands in for both the window capture and the Interception device.
+    The simulation follows the wall clock in fixed ticks, so the durations of queued key-presses and of sleeps in the
+    decision loop mean the same as they do in game, and a run takes as long as the movement it simulates.
+    """
+
+    def __init__(self, world=EXAMPLE_MAP, region=(5, 60, 180, 130), start=(20, 52), tick=1 / 120,
+                 window=(600, 800), rune=None, others=()):
+        self.world = world
+        self.region = region
+        self.tick = tick
+        self.rune = rune
+        self.others = list(others)
+        self.x, self.y = float(start[0]), float(start[1])
+        self.vx, self.vy = 0.0, 0.0
+        self.grounded = True
+        self.on_rope = None
+        self.double_jumped = False
+        self.held = set()
+        self.facing = 1
+        self.time = 0.0
+        self.ticks = 0
+        self.grabs = 0
+        self.reversals = 0
+        self._last_grab = None
+        self._pending_time = 0.0
+        self._last_up = None
+        self._direction = 0
+        self._lock = threading.Lock()
+        self._pressed = []
+        self._backend = None
+
+        top, left, bottom, right = region
+        self.image = np.zeros(window + (4,), dtype=np.uint8)
+        self.image[left - 2:right + 2, top - 2:bottom + 2] = FRAME_BGRA
+        # The mini-map is cropped as image[left:right, top:bottom], see Game.
+        self.background = np.empty((right - left, bottom - top, 4), dtype=np.uint8)
+        self.background[:] = BACKGROUND_BGRA
+        for y, x1, x2 in world.platforms:
+            self.background[y + 1 + DOT_SIZE // 2, x1:x2 + 1] = PLATFORM_BGRA
+        for x, y1, y2 in world.ropes:
+            self.background[y1:y2 + 1, x] = ROPE_BGRA
+
+    def connect(self, backend):
+        """
+        Makes the simulated player react to every stroke sent through a mock_backend.
+        Several simulators can share a backend like windows share the keyboard, only the focused one reacts.
+        """
+        self._backend = backend
+        backend.listeners.append(self.on_strokes)
+
+    def focus(self):
+        if self._backend is not None:
+            self._backend.focused = self
+
+    def on_strokes(self, device, strokes):
+        if getattr(self._backend, "focused", self) is not self:
+            return
+        with self._lock:
+            for s in strokes:
+                key = KEY_NAMES.get(s.code)
+                if key is None:
+                    continue
+                # Keys go down on even states and up on odd ones, for both arrow and other keys.
+                if s.state & 1 == 0:
+                    if key not in self.held:
+                        self._pressed.append(key)
+                    self.held.add(key)
+                else:
+                    self.held.discard(key)
+
+    @contextlib.contextmanager
+    def grab(self):
+        now = time.perf_counter()
+        if self._last_grab is not None:
+            # Never simulate more than a few seconds at once, e.g. after the process was suspended.
+            self._pending_time = min(self._pending_time + now - self._last_grab, 5.0)
+        self._last_grab = now
+        while self._pending_time >= self.tick:
+            self._pending_time -= self.tick
+            self.step()
+        self.grabs += 1
+        yield self.render()
+
+    def render(self):
+        top, left, bottom, right = self.region
+        minimap = self.image[left:right, top:bottom]
+        minimap[:] = self.background
+        dots = [(self.x, self.y, PLAYER_BGRA)]
+        if self.rune is not None:
+            dots.append((self.rune[0], self.rune[1], RUNE_BGRA))
+        dots.extend((x, y, ENEMY_BGRA) for x, y in self.others)
+        for x, y, color in dots:
+            x1, y1 = int(round(x)) - DOT_SIZE // 2, int(round(y)) - DOT_SIZE // 2
+            minimap[max(0, y1):max(0, y1 + DOT_SIZE), max(0, x1):max(0, x1 + DOT_SIZE)] = color
+        return self.image
+
+    def _platform_below(self, x, y1, y2):
+        """
+        Returns the highest platform crossed when falling from y1 to y2 at x, or None.
+        """
+        crossed = [y for y, x1, x2 in self.world.platforms if x1 <= x <= x2 and y1 <= y <= y2]
+        return min(crossed) if crossed else None
+
+    def _rope_at(self, x, y):
+        for rope_x, y1, y2 in self.world.ropes:
+            if abs(rope_x - x) <= 2 and y1 <= y <= y2:
+                return rope_x, y1, y2
+        return None
+
+    def _clamp_x(self, x):
+        # The edges of the mini-map are walls, the player is stopped before any platform check.
+        return min(max(x, 0.0), self.world.width - 1.0)
+
+    def step(self):
+        """
+        Advances the simulation by one tick.
+        """
+        with self._lock:
+            held = set(self.held)
+            pressed, self._pressed = self._pressed, []
+        dt = self.tick
+        self.time += dt
+        self.ticks += 1
+
+        direction = ("RIGHT" in held) - ("LEFT" in held)
+        if direction:
+            if self._direction and direction != self._direction:
+                self.reversals += 1
+            self._direction = direction
+            self.facing = direction
+
+        for key in pressed:
+            if key == JUMP_KEY:
+                if self.on_rope is not None:
+                    self.on_rope = None
+                    self.vy = -JUMP_SPEED / 2
+                elif self.grounded and "DOWN" in held:
+                    # Drop down through the platform, unless it is the ground.
+                    if self.y < max(y for y, _, _ in self.world.platforms):
+                        self.grounded = False
+                        self.y += 1
+                        self.vy = 0.0
+                elif self.grounded:
+                    self.grounded = False
+                    self.vy = -JUMP_SPEED
+                    self.double_jumped = False
+                elif not self.double_jumped:
+                    self.double_jumped = True
+                    self.vx = DOUBLE_JUMP_SPEED * self.facing
+            elif key == ROPE_LIFT_KEY and self.on_rope is None:
+                # Rope lift goes straight up.
+                self.grounded = False
+                self.vx, self.vy = 0.0, -ROPE_LIFT_SPEED
+            elif key == "UP" and self.on_rope is None:
+                self.on_rope = self._rope_at(self.x, self.y)
+                if self.on_rope is None and self.grounded:
+                    if self._last_up is not None and self.time - self._last_up <= UP_JUMP_WINDOW:
+                        self.grounded = False
+                        self.vx, self.vy = 0.0, -UP_JUMP_SPEED
+                        self._last_up = None
+                    else:
+                        self._last_up = self.time
+
+        if self.on_rope is not None:
+            rope_x, y1, y2 = self.on_rope
+            self.x = rope_x
+            self.vx = self.vy = 0.0
+            if "UP" in held:
+                self.y -= CLIMB_SPEED * dt
+            elif "DOWN" in held:
+                self.y += CLIMB_SPEED * dt
+            if self.y <= y1:
+                # Climbing off the top of a rope lands on the platform it hangs from.
+                self.y, self.on_rope, self.grounded = y1, None, True
+            elif self.y >= y2:
+                self.y, self.on_rope, self.grounded = y2, None, True
+            return
+
+        if self.grounded:
+            self.vx = WALK_SPEED * direction
+            self.x = self._clamp_x(self.x + self.vx * dt)
+            if self._platform_below(self.x, self.y, self.y) is None:
+                # Walked off the edge of a platform.
+                self.grounded = False
+                self.vy = 0.0
+        else:
+            if direction and abs(self.vx) < WALK_SPEED:
+                self.vx = WALK_SPEED * direction
+            self.x = self._clamp_x(self.x + self.vx * dt)
+            self.vy += GRAVITY * dt
+            y = self.y + self.vy * dt
+            landing = self._platform_below(self.x, self.y + 1e-6, y) if self.vy > 0 else None
+            if landing is not None:
+                self.y, self.vy, self.vx, self.grounded = landing, 0.0, 0.0, True
+            else:
+                self.y = y
+            if self.y < 0:
+                # Bumped into the top of the mini-map.
+                self.vy = 0.0
+        self.y = min(max(self.y, 0.0), self.world.height - 1.0)
+
+
+def simulate(targets, simulator=None, fps=30, timeout=30, navigation=None):
+    """
+    Runs Player.go_to against a MinimapSimulator for every target and returns a result per target, with whether
+    it was reached within timeout seconds, the pictures go_to decided on, the simulated seconds, the direction reversals
+    and where the player ended up.
+    Pictures are captured in the background at fps like in main.py, or as fast as go_to asks for them if fps is None.
+    With a NavigationGraph, the player learns the map and moves with Player.travel instead, the result then also has
+    the seconds the planned path was expected to take, None if no path was known.
+    """
+    simulator = simulator if simulator is not None else MinimapSimulator()
+    backend = mock_backend()
+    simulator.connect(backend)
+    game = Game(simulator.region, source=simulator)
+    if fps is not None:
+        game.start_capture(fps)
+    player = Player(interception(backend), 1, game, navigation=navigation)
+    results = []
+    tracker = game.tracker
+    for target in targets:
+        # Every picture the player decided on was looked for the dot in once.
+        located, sim_time, reversals = tracker.hits + tracker.misses, simulator.time, simulator.reversals
+        start = time.perf_counter()
+        estimate = None
+        if navigation is not None:
+            plan = navigation.plan((simulator.x, simulator.y), target)
+            estimate = plan[1] if plan is not None else None
+            reached = player.travel(target, timeout=timeout)
+        else:
+            reached = player.go_to(target, timeout=timeout)
+        player.wait()
+        results.append({
+            "target": target,
+            "reached": reached,
+            "estimate": estimate,
+            "iterations": tracker.hits + tracker.misses - located,
+            "seconds": simulator.time - sim_time,
+            "reversals": simulator.reversals - reversals,
+            "position": (simulator.x, simulator.y),
+            "wall_seconds": time.perf_counter() - start,
+        })
+    player.input.close()
+    game.stop_capture()
+    return results
+
+
+if __name__ == "__main__":
+    for result in simulate([(97, 32.5), (30, 52), (50, 15), (150, 52), (97, 32.5)]):
+        print(result)
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+from collections import namedtuple
+from capture import CaptureScheduler
+from input_scheduler import InputScheduler
+from player import Player
+from profiling import profiler
+from rotation import RotationScheduler
+
+# A Game and Player bound to one application window, and the rotation they run.
+Client = namedtuple("Client", ["name", "game", "player", "rotation"])
+
+
+class InputDispatcher:
+    """
+    Sends the strokes of every client through one Interception device, on a single InputScheduler thread.
+    Keys go to the window in front, so a client's window is brought to the front before its strokes whenever another
+    client sent the last ones. Keys held across such a switch are let go by the game, clients should not rely on
+    holding keys while another client acts.
+    """
+
+    def __init__(self, context, device):
+        self.context = context
+        self.device = device
+        self.input = InputScheduler()
+        self.focused = None
+        self.switches = 0
+
+    def focuser(self, source):
+        """
+        Returns the focus() of the Player of a client whose pictures come from source, see FrameSource.focus().
+        Strokes are only ever sent from the scheduler thread, so no lock is needed.
+        """
+        def focus():
+            if self.focused is not source:
+                source.focus()
+                self.focused = source
+                self.switches += 1
+                profiler.count("input.focus_switches")
+        return focus
+
+    def close(self):
+        self.input.close()
+
+
+class Supervisor:
+    """
+    Runs several clients in one process, each a Game and Player bound to its own window running its own rotation.
+    Pictures of every window are taken by one CaptureScheduler, which spreads the grabs fairly across windows, and
+    strokes are sent by one InputDispatcher. The rotations share one asyncio loop, so adding a client adds no threads
+    of its own, only the pictures of its window and the work of deciding on them.
+    """
+
+    def __init__(self, context, device, fps=30, max_rate=None):
+        """
+        Every window is captured fps times per second, but no more than max_rate pictures are taken per second in total.
+        """
+        self.fps = fps
+        self.capture = CaptureScheduler(max_rate)
+        self.dispatcher = InputDispatcher(context, device)
+        self.clients = []
+
+    def add(self, game, skills, name=None, navigation=None, on_rune=None, on_other=None):
+        """
+        Adds a client playing the window of a Game with the skills of a rotation, see load_rotation().
+        on_rune(client, location) and on_other(client, locations) work like the handlers of RotationScheduler.
+        """
+        game.start_capture(self.fps, scheduler=self.capture)
+        player = Player(self.dispatcher.context, self.dispatcher.device, game, navigation=navigation,
+                        input=self.dispatcher.input, focus=self.dispatcher.focuser(game.source))
+        rotation = RotationScheduler(player, game, skills)
+        client = Client(name if name is not None else f"client {len(self.clients) + 1}", game, player, rotation)
+        # The handlers are told which client they are called for.
+        rotation.on_rune = functools.partial(on_rune, client) if on_rune is not None else None
+        rotation.on_other = functools.partial(on_other, client) if on_other is not None else None
+        self.clients.append(client)
+        return client
+
+    async def run(self, duration=None):
+        """
+        Runs the rotation of every client for duration seconds, or until cancelled.
+        """
+        self.capture.start()
+        await asyncio.gather(*(client.rotation.run(duration) for client in self.clients))
+
+    def close(self):
+        for client in self.clients:
+            client.game.stop_capture()
+        self.capture.stop()
+        self.dispatcher.close()
@@ -0,0 +1,26 @@
+import time
+from types import SimpleNamespace
+from input_scheduler import InputScheduler
+from interception import interception, mock_backend
+from player import Player
+
+
+def test_wait_only_waits_for_own_strokes():
+    context = interception(mock_backend())
+    scheduler = InputScheduler()
+    game = SimpleNamespace(recorder=None)
+    a = Player(context, 1, game, input=scheduler)
+    b = Player(context, 2, game, input=scheduler)
+    try:
+        # The other player keeps a key held for a long time, its up-stroke stays queued.
+        b.press("LEFT", 2.0)
+        a.press("Q")
+        start = time.perf_counter()
+        assert a.wait(3)
+        assert time.perf_counter() - start < 1.0
+        assert scheduler.pending(owner=a) == 0
+        assert scheduler.pending(owner=b) == 1
+        assert not b.wait(0.1)
+    finally:
+        b.release_all()
+        scheduler.close()